@@ -0,0 +1,117 @@
+"""Microbenchmark of the per-call cost of the wrapper functions
+Compares the prebound binding layer with the original per-call conversion (if-chain type resolution,
+ctypes scalars built on every call, dynamic attribute lookup on an unbound library handle).
+Usage: python bench_calls.py msx_file [--number N]
+The library is the one epanetmsxmodule loads (set EPANETMSX_LIBRARY to pick a build, e.g. the stub built by
+stub/build.py, which opens the network files written by run_benchmarks.py); a library that needs an
+open EPANET project has to be benchmarked from a script that opens it first."""
+import argparse
+import ctypes
+import os
+import sys
+import timeit
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import epanetmsxmodule as msx
+
+# the library handle itself: attribute access gives the function objects the wrapper used to call
+_legacy = msx._lib
+
+def legacy_getqual(type,ind,spe):
+    type_ind = 100
+    if type == 'MSX_NODE' or type == 0:
+        type_ind = 0
+    if type == 'MSX_LINK' or type == 1:
+        type_ind = 1
+    if type_ind == 100: raise Exception('unrecognized type')
+    qual = ctypes.c_double()
+    ierr= _legacy.MSXgetqual(ctypes.c_int(type_ind),ctypes.c_int(ind),ctypes.c_int(spe),ctypes.byref(qual))
+    if ierr!=0: raise msx.MSXtoolkitError(ierr)
+    return qual.value
+
+def legacy_getindex(type,name):
+    type_ind = 100
+    if type == 'MSX_SPECIES' or type == 3:
+        type_ind = 3
+    if type == 'MSX_CONSTANT' or type == 6:
+        type_ind = 6
+    if type == 'MSX_PARAMETER' or type == 5:
+        type_ind = 5
+    if type == 'MSX_PATTERN' or type == 7:
+        type_ind = 7
+    if type_ind == 100: raise Exception('unrecognized type')
+    ind = ctypes.c_int()
+    ierr= _legacy.MSXgetindex(type_ind,ctypes.c_char_p(name.encode()),ctypes.byref(ind))
+    if ierr!=0: raise msx.MSXtoolkitError(ierr)
+    return ind.value
+
+def legacy_getID(type,index):
+    type_ind = 100
+    if type == 'MSX_SPECIES' or type == 3:
+        type_ind = 3
+    if type == 'MSX_CONSTANT' or type == 6:
+        type_ind = 6
+    if type == 'MSX_PARAMETER' or type == 5:
+        type_ind = 5
+    if type == 'MSX_PATTERN' or type == 7:
+        type_ind = 7
+    if type_ind == 100: raise Exception('unrecognized type')
+    maxlen = 32
+    id = ctypes.create_string_buffer(maxlen)
+    ierr= _legacy.MSXgetID(type_ind,ctypes.c_int(index),ctypes.byref(id),ctypes.c_int(maxlen-1))
+    if ierr!=0: raise msx.MSXtoolkitError(ierr)
+    return id.value
+
+def legacy_setsource(node,spe,type_n,level,pat):
+    type_ind = 100
+    if type_n == 'MSX_NOSOURCE' or type_n == -1:
+        type_ind = -1
+    if type_n == 'MSX_CONCEN' or type_n == 0:
+        type_ind = 0
+    if type_n == 'MSX_MASS' or type_n == 1:
+        type_ind = 1
+    if type_n == 'MSX_SETPOINT' or type_n == 2:
+        type_ind = 2
+    if type_n == 'MSX_FLOWPACED' or type_n == 3:
+        type_ind = 3
+    if type_ind == 100: raise Exception('unrecognized type')
+    ierr= _legacy.MSXsetsource(ctypes.c_int(node),ctypes.c_int(spe),ctypes.c_int(type_ind),ctypes.c_double(level),ctypes.c_int(pat))
+    if ierr!=0: raise msx.MSXtoolkitError(ierr)
+
+def legacy_step():
+    t = ctypes.c_long()
+    tleft = ctypes.c_long()
+    ierr = _legacy.MSXstep(ctypes.byref(t),ctypes.byref(tleft))
+    if ierr != 0: raise msx.MSXtoolkitError(ierr)
+    return [t.value, tleft.value]
+
+CASES = [
+    ('MSXgetqual', legacy_getqual, msx.MSXgetqual, ('MSX_LINK',1,1)),
+    ('MSXgetindex', legacy_getindex, msx.MSXgetindex, ('MSX_SPECIES',None)),
+    ('MSXgetID', legacy_getID, msx.MSXgetID, ('MSX_SPECIES',1)),
+    ('MSXsetsource', legacy_setsource, msx.MSXsetsource, (1,1,'MSX_SETPOINT',1.0,0)),
+]
+
+def percall(func,args,number,repeat=5):
+    return min(timeit.repeat(lambda: func(*args),number=number,repeat=repeat))/number
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('msxfile')
+    parser.add_argument('--number',type=int,default=100000,help='calls per timing run')
+    args = parser.parse_args(argv)
+    msx.MSXopen(args.msxfile)
+    try:
+        msx.MSXinit(0)
+        print('%-14s %12s %12s %8s' % ('function','before (us)','after (us)','speedup'))
+        for name,before,after,fargs in CASES:
+            if name == 'MSXgetindex':
+                fargs = (fargs[0],msx.MSXgetID('MSX_SPECIES',1).decode())
+            tb = percall(before,fargs,args.number)
+            ta = percall(after,fargs,args.number)
+            print('%-14s %12.3f %12.3f %7.2fx' % (name,tb*1e6,ta*1e6,tb/ta))
+    finally:
+        msx.MSXclose()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark of MSXreadreport against line-by-line regex parsing of an MSXreport text report
+Generates a synthetic report laid out like the ones EPANET-MSX writes (page breaks included) and times both parsers.
+Usage: python bench_report.py [--mb 300] [--species 4] [--periods 97] [--keep report_file]"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import epanetmsxmodule as msx
+
+PAGESIZE = 60
+
+def generate(fname,mb,nspecies,periods):
+    """Writes report tables until the file reaches mb megabytes; returns the number of tables
+    Like MSXreport, node tables leave out the wall species (link tables have one more column), and a
+    page break repeats the object header and the column headers before the table goes on."""
+    def tablehdr(n):
+        species = ''.join('  %10s' % ('S%d' % (j+1)) for j in range(n))
+        units = ''.join('  %10s' % 'MG/L' for j in range(n))
+        return '  Time   %s\n  hr:min %s\n  -------%s\n' % (species,units,'  ----------'*n)
+    headers = {'Node':tablehdr(nspecies),'Link':tablehdr(nspecies+1)}
+    rng = np.random.default_rng(1)
+    hours,minutes = np.divmod(np.arange(periods)*900//60,60)
+    target = mb*1000000
+    count = 0
+    page = 1
+    with open(fname,'w') as f:
+        f.write('  Page 1                                    EPANET-MSX 1.1\n\n')
+        lines = 2
+        while f.tell() < target:
+            count += 1
+            kind = 'Node' if count % 2 else 'Link'
+            title = '  <<< %s %s%d >>>\n\n' % (kind,kind[0],count)
+            f.write('\n'+title+headers[kind])
+            lines += 6
+            values = rng.random((periods,nspecies+(kind == 'Link')))*10
+            for p in range(periods):
+                if lines >= PAGESIZE:
+                    page += 1
+                    f.write('\f\n  Page %d                                    EPANET-MSX 1.1\n\n%s%s' % (page,title,headers[kind]))
+                    lines = 8
+                f.write('  %4d:%02d%s\n' % (hours[p],minutes[p],''.join('  %10.4f' % v for v in values[p])))
+                lines += 1
+    return count
+
+_HEADER = re.compile(r'<<< (Node|Link) (\S+) >>>')
+_ROW = re.compile(r'^\s*(\d+):(\d\d)((?:\s+[-+.\deE]+)+)\s*$')
+
+def linebyline(fname):
+    """The usual per-line regex parser: dict of ID -> list of (seconds, [values])"""
+    tables = {}
+    current = None
+    with open(fname) as f:
+        for line in f:
+            m = _HEADER.search(line)
+            if m:
+                current = tables.setdefault(m.group(2),[])
+                continue
+            m = _ROW.match(line)
+            if m and current is not None:
+                current.append((int(m.group(1))*3600+int(m.group(2))*60,[float(x) for x in m.group(3).split()]))
+    return tables
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mb',type=float,default=300,help='size of the generated report in MB')
+    parser.add_argument('--species',type=int,default=4)
+    parser.add_argument('--periods',type=int,default=97,help='reporting periods per table')
+    parser.add_argument('--keep',help='write the report to this file and keep it')
+    args = parser.parse_args(argv)
+    fname = args.keep or os.path.join(tempfile.mkdtemp(),'bench.rpt')
+    t0 = time.perf_counter()
+    tables = generate(fname,args.mb,args.species,args.periods)
+    size = os.path.getsize(fname)/1e6
+    print('generated %.0f MB, %d tables in %.1f s' % (size,tables,time.perf_counter()-t0))
+    try:
+        t0 = time.perf_counter()
+        fast = msx.MSXreadreport(fname)
+        tfast = time.perf_counter()-t0
+        t0 = time.perf_counter()
+        slow = linebyline(fname)
+        tslow = time.perf_counter()-t0
+        for table in fast.values():
+            assert len(set(table.ids)) == len(table.ids)
+            for k in (0,-1):
+                assert np.allclose(table.values[k],[v for t,v in slow[table.ids[k]]])
+        print('%-16s %8.2f s %8.1f MB/s' % ('MSXreadreport',tfast,size/tfast))
+        print('%-16s %8.2f s %8.1f MB/s' % ('line by line',tslow,size/tslow))
+        print('speedup %.1fx' % (tslow/tfast))
+    finally:
+        if not args.keep:
+            os.remove(fname)
+            os.rmdir(os.path.dirname(fname))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""Benchmark suite of the wrapper against the stub EPANET-MSX library (stub/msxstub.c)
+Builds the stub with the local C compiler, opens a synthetic network of the requested size and writes a JSON
+document with the per-call latency of the getters and setters, the step-loop throughput, the memory allocated per
+simulated step and the speed of the result readers, so that runs can be diffed to catch regressions in the binding layer.
+Usage: python run_benchmarks.py [--nodes 1000] [--links 1200] [--species 4] [--duration 86400] [--step 300]
+                                [--number 20000] [--output results.json] [--library library]
+Times are in seconds per call (per element for the bulk functions) unless the key says otherwise."""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.join(HERE,'stub'))
+sys.path.insert(0,os.path.join(HERE,'..'))
+import build
+
+msx = None
+
+def networkfile(folder,args):
+    """Writes the keyword file the stub reads in MSXopen; returns its name"""
+    fname = os.path.join(folder,'bench.msx')
+    with open(fname,'w') as f:
+        f.write('NODES %d\nLINKS %d\nSPECIES %d\nPARAMETERS %d\nCONSTANTS %d\nPATTERNS %d\n'
+                'DURATION %d\nSTEP %d\nRSTEP %d\nREPORT %s\n' %
+                (args.nodes,args.links,args.species,args.parameters,args.constants,1,
+                 args.duration,args.step,args.rstep,os.path.join(folder,'bench.rpt')))
+    return fname
+
+def latency(func,args,number,repeat=5):
+    """Best and median time per call over repeat runs of number calls"""
+    runs = [t/number for t in timeit.repeat(lambda: func(*args),number=number,repeat=repeat)]
+    return {'best':min(runs),'median':statistics.median(runs)}
+
+def calls(number):
+    """Per-call latency of the scalar getters and setters"""
+    pattern = [msx.MSXgetpatternvalue(1,period) for period in range(1,msx.MSXgetpatternlen(1)+1)]
+    species = msx.MSXgetID('MSX_SPECIES',1)
+    species = species.decode() if isinstance(species,bytes) else species
+    getters = [
+        ('MSXgetqual',msx.MSXgetqual,('MSX_NODE',1,1)),
+        ('MSXgetinitqual',msx.MSXgetinitqual,('MSX_NODE',1,1)),
+        ('MSXgetparameter',msx.MSXgetparameter,('MSX_LINK',1,1)),
+        ('MSXgetconstant',msx.MSXgetconstant,(1,)),
+        ('MSXgetsource',msx.MSXgetsource,(1,1)),
+        ('MSXgetpatternlen',msx.MSXgetpatternlen,(1,)),
+        ('MSXgetpatternvalue',msx.MSXgetpatternvalue,(1,1)),
+        ('MSXgetcount',msx.MSXgetcount,('MSX_NODE',)),
+        ('MSXgetindex',msx.MSXgetindex,('MSX_SPECIES',species)),
+        ('MSXgetID',msx.MSXgetID,('MSX_SPECIES',1)),
+        ('MSXgetIDlen',msx.MSXgetIDlen,('MSX_SPECIES',1)),
+        ('MSXgetspecies',msx.MSXgetspecies,(1,)),
+    ]
+    # setters write back the values already there, so the simulation is unchanged
+    setters = [
+        ('MSXsetconstant',msx.MSXsetconstant,(1,msx.MSXgetconstant(1))),
+        ('MSXsetparameter',msx.MSXsetparameter,('MSX_LINK',1,1,msx.MSXgetparameter('MSX_LINK',1,1))),
+        ('MSXsetinitqual',msx.MSXsetinitqual,('MSX_NODE',1,1,msx.MSXgetinitqual('MSX_NODE',1,1))),
+        ('MSXsetsource',msx.MSXsetsource,(1,1)+tuple(msx.MSXgetsource(1,1))),
+        ('MSXsetpatternvalue',msx.MSXsetpatternvalue,(1,1,pattern[0])),
+        ('MSXsetpattern',msx.MSXsetpattern,(1,pattern)),
+    ]
+    return {'getters':{name:latency(func,fargs,number) for name,func,fargs in getters},
+            'setters':{name:latency(func,fargs,number) for name,func,fargs in setters}}
+
+def bulk(number):
+    """Per-element latency of the array getters and setters over the whole network"""
+    nnodes = msx.MSXgetcount('MSX_NODE')
+    nspecies = msx.MSXgetcount('MSX_SPECIES')
+    repeat = max(1,number//(nnodes*nspecies))
+    quals = np.empty((nnodes,nspecies))
+    initqual = np.array([[msx.MSXgetinitqual('MSX_NODE',i,s) for s in range(1,nspecies+1)] for i in range(1,nnodes+1)])
+    parameter = np.array([msx.MSXgetparameter('MSX_NODE',i,1) for i in range(1,nnodes+1)])
+    sources = msx.MSXgetsourcearray()
+    cases = [
+        ('MSXgetqualarray',msx.MSXgetqualarray,('MSX_NODE',None,None,quals),quals.size),
+        ('MSXsetinitqualarray',msx.MSXsetinitqualarray,('MSX_NODE',None,initqual),initqual.size),
+        ('MSXsetparameterarray',msx.MSXsetparameterarray,('MSX_NODE',1,parameter),parameter.size),
+        ('MSXgetsourcearray',msx.MSXgetsourcearray,(),sources.size),
+        ('MSXsetsourcearray',msx.MSXsetsourcearray,(sources,),sources.size),
+        ('MSXgetpatterns',msx.MSXgetpatterns,(),sum(len(mult) for mult in msx.MSXgetpatterns().values())),
+    ]
+    out = {}
+    for name,func,fargs,elements in cases:
+        t = latency(func,fargs,repeat,3)
+        out[name] = {'elements':elements,'best':t['best']/elements,'median':t['median']/elements}
+    return out
+
+def stepping():
+    """Throughput of the water quality step loop, with and without reading every node concentration"""
+    def rates(steps,t,wall):
+        return {'steps':steps,'wall_s':wall,'steps_per_s':steps/wall,'simulated_s_per_wall_s':t/wall}
+    out = {}
+    t0 = time.perf_counter()
+    msx.MSXsolveQ()
+    out['MSXsolveQ'] = {'wall_s':time.perf_counter()-t0}
+    msx.MSXinit(0)
+    steps = 0
+    t0 = time.perf_counter()
+    while True:
+        t,tleft = msx.MSXstep()
+        steps += 1
+        if tleft <= 0: break
+    out['MSXstep'] = rates(steps,t,time.perf_counter()-t0)
+    steps = 0
+    t0 = time.perf_counter()
+    for t,quals in msx.MSXsteps('MSX_NODE'):
+        steps += 1
+    out['MSXsteps_all_nodes'] = rates(steps,t,time.perf_counter()-t0)
+    return out
+
+def memory():
+    """Python memory allocated per simulated step (net and peak, from tracemalloc) by the step loops
+    Tracing starts after the first step, so the buffers set up once per run are not counted."""
+    loops = {'MSXstep':_stepper,'MSXsteps_all_nodes':lambda: msx.MSXsteps('MSX_NODE')}
+    out = {}
+    for name,loop in loops.items():
+        steps = loop()
+        next(steps)
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            count = sum(1 for step in steps)
+            current,peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        out[name] = {'steps':count,'net_bytes_per_step':(current-start)/count,'peak_bytes':peak-start}
+    return out
+
+def _stepper():
+    """MSXinit, then MSXstep to the end of the simulation, one step per iteration"""
+    msx.MSXinit(0)
+    while True:
+        t,tleft = msx.MSXstep()
+        yield t
+        if tleft <= 0: return
+
+def results(folder):
+    """Read speed of the binary output file and of the text report written by the stub"""
+    out = {}
+    msx.MSXsolveQ()
+    outfile = os.path.join(folder,'bench.bin')
+    msx.MSXsaveoutfile(outfile)
+    t0 = time.perf_counter()
+    with msx.MSXoutfile(outfile) as f:
+        f.nodequal.sum()
+        f.linkqual.sum()
+    wall = time.perf_counter()-t0
+    out['MSXoutfile'] = {'bytes':os.path.getsize(outfile),'wall_s':wall,'mb_per_s':os.path.getsize(outfile)/1e6/wall}
+    msx.MSXreport()
+    report = os.path.join(folder,'bench.rpt')
+    t0 = time.perf_counter()
+    msx.MSXreadreport(report)
+    wall = time.perf_counter()-t0
+    out['MSXreadreport'] = {'bytes':os.path.getsize(report),'wall_s':wall,'mb_per_s':os.path.getsize(report)/1e6/wall}
+    return out
+
+def main(argv=None):
+    global msx
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes',type=int,default=1000)
+    parser.add_argument('--links',type=int,default=1200)
+    parser.add_argument('--species',type=int,default=4)
+    parser.add_argument('--parameters',type=int,default=2)
+    parser.add_argument('--constants',type=int,default=2)
+    parser.add_argument('--duration',type=int,default=86400,help='simulated seconds')
+    parser.add_argument('--step',type=int,default=300,help='water quality time step in seconds')
+    parser.add_argument('--rstep',type=int,default=3600,help='reporting time step in seconds')
+    parser.add_argument('--number',type=int,default=20000,help='calls per timing run')
+    parser.add_argument('--library',help='library to benchmark instead of building the stub')
+    parser.add_argument('--cc',help='C compiler for the stub (default: $CC or cc)')
+    parser.add_argument('--output',help='also write the JSON results to this file')
+    args = parser.parse_args(argv)
+    library = os.path.abspath(args.library or build.build(cc=args.cc))
+    # the module loads its library when imported
+    os.environ['EPANETMSX_LIBRARY'] = library
+    msx = importlib.import_module('epanetmsxmodule')
+    folder = tempfile.mkdtemp()
+    try:
+        msx.MSXopen(networkfile(folder,args))
+        try:
+            msx.MSXsolveH()
+            msx.MSXinit(0)
+            suite = {
+                'calls':calls(args.number),
+                'bulk':bulk(args.number),
+                'stepping':stepping(),
+                'memory':memory(),
+                'results':results(folder),
+            }
+        finally:
+            msx.MSXclose()
+    finally:
+        shutil.rmtree(folder,ignore_errors=True)
+    suite['environment'] = {
+        'date':datetime.datetime.now().isoformat(timespec='seconds'),
+        'python':platform.python_version(),'numpy':np.__version__,'platform':platform.platform(),
+        'library':library,
+        'network':{key:getattr(args,key) for key in ('nodes','links','species','parameters','constants','duration','step','rstep')},
+    }
+    text = json.dumps(suite,indent=1,sort_keys=True)
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            f.write(text)
+    print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Builds the stub EPANET-MSX library (msxstub.c) used by the benchmarks
+Usage: python build.py [--cc compiler] [--output library] [--force]
+Prints the path of the library; point EPANETMSX_LIBRARY at it to load it in epanetmsxmodule."""
+import argparse
+import os
+import platform
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(HERE,'msxstub.c')
+
+def libraryname():
+    """File name of the shared library on this platform"""
+    plat = platform.system()
+    if plat == 'Windows': return 'epanetmsx.dll'
+    if plat == 'Darwin': return 'libepanetmsx.dylib'
+    return 'libepanetmsx.so'
+
+def build(output=None,cc=None,force=False):
+    """Compiles msxstub.c unless the library is newer than the source; returns the library path
+    cc defaults to $CC, then cc"""
+    if output is None: output = os.path.join(HERE,libraryname())
+    if not force and os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(SOURCE):
+        return output
+    if cc is None: cc = os.environ.get('CC','cc')
+    cmd = [cc,'-O2','-shared','-o',output,SOURCE]
+    if platform.system() != 'Windows': cmd[3:3] = ['-fPIC']
+    cmd.append('-lm')
+    subprocess.check_call(cmd)
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cc',help='C compiler (default: $CC or cc)')
+    parser.add_argument('--output',help='library file to write (default: next to msxstub.c)')
+    parser.add_argument('--force',action='store_true',help='rebuild even if the library is up to date')
+    args = parser.parse_args(argv)
+    print(build(args.output,args.cc,args.force))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,604 @@
+/*
+ * Stub EPANET-MSX toolkit used to benchmark the Python wrapper.
+ *
+ * Implements the toolkit entry points called by epanetmsxmodule.py on a
+ * synthetic network. The "MSX input file" passed to MSXopen is a plain
+ * keyword file that sizes the network, e.g.
+ *
+ *     NODES      1000
+ *     LINKS      1200
+ *     SPECIES    4
+ *     PARAMETERS 2
+ *     CONSTANTS  2
+ *     PATTERNS   1
+ *     DURATION   86400
+ *     STEP       300
+ *     RSTEP      3600
+ *     REPORT     out.rpt
+ *
+ * Water quality follows a first-order decay towards a per-location level so
+ * results change every step; nothing here models real chemistry.
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+
+#ifdef _WIN32
+#define MSXEXPORT __declspec(dllexport)
+#else
+#define MSXEXPORT __attribute__((visibility("default")))
+#endif
+
+#define MSX_NODE      0
+#define MSX_LINK      1
+#define MSX_TANK      2
+#define MSX_SPECIES   3
+#define MSX_TERM      4
+#define MSX_PARAMETER 5
+#define MSX_CONSTANT  6
+#define MSX_PATTERN   7
+
+#define ERR_OPEN_MSX_FILE        503
+#define ERR_OPEN_HYD_FILE        504
+#define ERR_OPEN_OUT_FILE        511
+#define ERR_INVALID_OBJECT_TYPE  515
+#define ERR_INVALID_OBJECT_INDEX 516
+#define ERR_UNDEFINED_OBJECT_ID  517
+#define ERR_INVALID_OBJECT_PARAMS 518
+#define ERR_MSX_NOT_OPENED       519
+#define ERR_MSX_OPENED           520
+#define ERR_OPEN_RPT_FILE        521
+
+#define MAXID    31
+#define MAXUNITS 16
+#define MAGIC    516114521
+#define VERSION  100000
+
+typedef struct {
+    int     length;
+    double *mult;
+    char    id[MAXID + 1];
+} Pattern;
+
+typedef struct {
+    int    type;
+    double level;
+    int    pat;
+} Source;
+
+static int      Open = 0;
+static int      Nobj[8];
+static long     Duration, Qstep, Rstep, T;
+static int      SaveFlag, Nperiods;
+static double  *Qual[2], *Init[2], *Param[2], *Const;
+static Source  *Sources;
+static Pattern *Patterns;
+static float   *Results;
+static size_t   ResultsCap;
+static char     RptFile[260];
+
+static int nlocs(int type)
+{
+    return type == MSX_NODE ? Nobj[MSX_NODE] : Nobj[MSX_LINK];
+}
+
+static int validloc(int type, int ind)
+{
+    if (type != MSX_NODE && type != MSX_LINK) return ERR_INVALID_OBJECT_TYPE;
+    if (ind < 1 || ind > nlocs(type)) return ERR_INVALID_OBJECT_INDEX;
+    return 0;
+}
+
+static const char *prefix(int type)
+{
+    switch (type)
+    {
+    case MSX_NODE:      return "N";
+    case MSX_LINK:      return "L";
+    case MSX_SPECIES:   return "S";
+    case MSX_PARAMETER: return "P";
+    case MSX_CONSTANT:  return "K";
+    default:            return NULL;
+    }
+}
+
+static void freeall(void)
+{
+    int i;
+    for (i = 0; i < 2; i++)
+    {
+        free(Qual[i]);  Qual[i] = NULL;
+        free(Init[i]);  Init[i] = NULL;
+        free(Param[i]); Param[i] = NULL;
+    }
+    free(Const);   Const = NULL;
+    free(Sources); Sources = NULL;
+    if (Patterns)
+        for (i = 1; i <= Nobj[MSX_PATTERN]; i++) free(Patterns[i].mult);
+    free(Patterns); Patterns = NULL;
+    free(Results);  Results = NULL;
+    ResultsCap = 0;
+}
+
+MSXEXPORT int MSXopen(char *fname)
+{
+    FILE *f;
+    char  key[64], val[260];
+    int   i, j;
+
+    if (Open) return ERR_MSX_OPENED;
+    f = fopen(fname, "r");
+    if (f == NULL) return ERR_OPEN_MSX_FILE;
+    memset(Nobj, 0, sizeof(Nobj));
+    Nobj[MSX_NODE] = 100;
+    Nobj[MSX_LINK] = 100;
+    Nobj[MSX_SPECIES] = 2;
+    Nobj[MSX_PARAMETER] = 1;
+    Nobj[MSX_CONSTANT] = 1;
+    Nobj[MSX_PATTERN] = 1;
+    Duration = 86400;
+    Qstep = 300;
+    Rstep = 3600;
+    snprintf(RptFile, sizeof(RptFile), "%s.rpt", fname);
+    while (fscanf(f, "%63s %259s", key, val) == 2)
+    {
+        if      (!strcmp(key, "NODES"))      Nobj[MSX_NODE] = atoi(val);
+        else if (!strcmp(key, "LINKS"))      Nobj[MSX_LINK] = atoi(val);
+        else if (!strcmp(key, "SPECIES"))    Nobj[MSX_SPECIES] = atoi(val);
+        else if (!strcmp(key, "PARAMETERS")) Nobj[MSX_PARAMETER] = atoi(val);
+        else if (!strcmp(key, "CONSTANTS"))  Nobj[MSX_CONSTANT] = atoi(val);
+        else if (!strcmp(key, "PATTERNS"))   Nobj[MSX_PATTERN] = atoi(val);
+        else if (!strcmp(key, "DURATION"))   Duration = atol(val);
+        else if (!strcmp(key, "STEP"))       Qstep = atol(val);
+        else if (!strcmp(key, "RSTEP"))      Rstep = atol(val);
+        else if (!strcmp(key, "REPORT"))     snprintf(RptFile, sizeof(RptFile), "%s", val);
+    }
+    fclose(f);
+
+    for (i = 0; i < 2; i++)
+    {
+        int n = nlocs(i) + 1;
+        Qual[i] = calloc((size_t)n * (Nobj[MSX_SPECIES] + 1), sizeof(double));
+        Init[i] = calloc((size_t)n * (Nobj[MSX_SPECIES] + 1), sizeof(double));
+        Param[i] = calloc((size_t)n * (Nobj[MSX_PARAMETER] + 1), sizeof(double));
+        for (j = 1; j < n; j++)
+        {
+            int m;
+            for (m = 1; m <= Nobj[MSX_SPECIES]; m++)
+                Init[i][j * (Nobj[MSX_SPECIES] + 1) + m] = 1.0 + 0.01 * (j % 97) + m;
+            for (m = 1; m <= Nobj[MSX_PARAMETER]; m++)
+                Param[i][j * (Nobj[MSX_PARAMETER] + 1) + m] = 0.1 * m;
+        }
+    }
+    Const = calloc(Nobj[MSX_CONSTANT] + 1, sizeof(double));
+    for (i = 1; i <= Nobj[MSX_CONSTANT]; i++) Const[i] = 1.0e-5 * i;
+    Sources = calloc((size_t)(Nobj[MSX_NODE] + 1) * (Nobj[MSX_SPECIES] + 1), sizeof(Source));
+    for (i = 0; i < (Nobj[MSX_NODE] + 1) * (Nobj[MSX_SPECIES] + 1); i++) Sources[i].type = -1;
+    Patterns = calloc(Nobj[MSX_PATTERN] + 1, sizeof(Pattern));
+    for (i = 1; i <= Nobj[MSX_PATTERN]; i++)
+    {
+        Patterns[i].length = 24;
+        Patterns[i].mult = malloc(24 * sizeof(double));
+        for (j = 0; j < 24; j++) Patterns[i].mult[j] = 1.0;
+        snprintf(Patterns[i].id, MAXID + 1, "PAT%d", i);
+    }
+    Open = 1;
+    return 0;
+}
+
+MSXEXPORT int MSXclose(void)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    freeall();
+    Open = 0;
+    return 0;
+}
+
+MSXEXPORT int MSXusehydfile(char *fname)
+{
+    FILE *f;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    f = fopen(fname, "rb");
+    if (f == NULL) return ERR_OPEN_HYD_FILE;
+    fclose(f);
+    return 0;
+}
+
+MSXEXPORT int MSXsolveH(void)
+{
+    return Open ? 0 : ERR_MSX_NOT_OPENED;
+}
+
+static void saveperiod(void)
+{
+    size_t need = (size_t)(Nperiods + 1) * (Nobj[MSX_NODE] + Nobj[MSX_LINK]) * Nobj[MSX_SPECIES];
+    int    i, j, m;
+    float *r;
+
+    if (need > ResultsCap)
+    {
+        ResultsCap = need * 2;
+        Results = realloc(Results, ResultsCap * sizeof(float));
+    }
+    r = Results + (size_t)Nperiods * (Nobj[MSX_NODE] + Nobj[MSX_LINK]) * Nobj[MSX_SPECIES];
+    for (i = 0; i < 2; i++)
+        for (m = 1; m <= Nobj[MSX_SPECIES]; m++)
+            for (j = 1; j <= nlocs(i); j++)
+                *r++ = (float)Qual[i][j * (Nobj[MSX_SPECIES] + 1) + m];
+    Nperiods++;
+}
+
+MSXEXPORT int MSXinit(int saveFlag)
+{
+    int i, n;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    for (i = 0; i < 2; i++)
+    {
+        n = (nlocs(i) + 1) * (Nobj[MSX_SPECIES] + 1);
+        memcpy(Qual[i], Init[i], n * sizeof(double));
+    }
+    T = 0;
+    SaveFlag = saveFlag;
+    Nperiods = 0;
+    if (SaveFlag) saveperiod();
+    return 0;
+}
+
+MSXEXPORT int MSXstep(long *t, long *tleft)
+{
+    int    i, j, m;
+    double k, x;
+
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (T < Duration)
+    {
+        T += Qstep;
+        if (T > Duration) T = Duration;
+        k = Nobj[MSX_CONSTANT] > 0 ? Const[1] : 1.0e-5;
+        x = exp(-k * Qstep);
+        for (i = 0; i < 2; i++)
+            for (j = 1; j <= nlocs(i); j++)
+                for (m = 1; m <= Nobj[MSX_SPECIES]; m++)
+                {
+                    double *q = &Qual[i][j * (Nobj[MSX_SPECIES] + 1) + m];
+                    double  s = 0.0;
+                    if (i == MSX_NODE && Sources[j * (Nobj[MSX_SPECIES] + 1) + m].type >= 0)
+                        s = Sources[j * (Nobj[MSX_SPECIES] + 1) + m].level;
+                    *q = *q * x + s * (1.0 - x);
+                }
+        if (SaveFlag && T % Rstep == 0) saveperiod();
+    }
+    *t = T;
+    *tleft = Duration - T;
+    return 0;
+}
+
+MSXEXPORT int MSXsolveQ(void)
+{
+    long t, tleft;
+    int  err = MSXinit(1);
+    if (err) return err;
+    do
+    {
+        err = MSXstep(&t, &tleft);
+    } while (!err && tleft > 0);
+    return err;
+}
+
+MSXEXPORT int MSXsaveoutfile(char *fname)
+{
+    FILE *f;
+    int   i, n, magic = MAGIC, version = VERSION, offset, zero = 0;
+    char  id[MAXID + 1], units[MAXUNITS];
+    int   rstep = (int)Rstep;
+
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    f = fopen(fname, "wb");
+    if (f == NULL) return ERR_OPEN_OUT_FILE;
+    fwrite(&magic, 4, 1, f);
+    fwrite(&version, 4, 1, f);
+    fwrite(&Nobj[MSX_NODE], 4, 1, f);
+    fwrite(&Nobj[MSX_LINK], 4, 1, f);
+    fwrite(&Nobj[MSX_SPECIES], 4, 1, f);
+    fwrite(&rstep, 4, 1, f);
+    for (i = 1; i <= Nobj[MSX_SPECIES]; i++)
+    {
+        n = snprintf(id, sizeof(id), "S%d", i);
+        fwrite(&n, 4, 1, f);
+        fwrite(id, 1, n, f);
+    }
+    for (i = 1; i <= Nobj[MSX_SPECIES]; i++)
+    {
+        memset(units, 0, MAXUNITS);
+        strcpy(units, "MG");
+        fwrite(units, 1, MAXUNITS, f);
+    }
+    offset = (int)ftell(f);
+    fwrite(Results, sizeof(float),
+           (size_t)Nperiods * (Nobj[MSX_NODE] + Nobj[MSX_LINK]) * Nobj[MSX_SPECIES], f);
+    fwrite(&offset, 4, 1, f);
+    fwrite(&Nperiods, 4, 1, f);
+    fwrite(&zero, 4, 1, f);
+    fwrite(&magic, 4, 1, f);
+    fclose(f);
+    return 0;
+}
+
+MSXEXPORT int MSXsavemsxfile(char *fname)
+{
+    FILE *f;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    f = fopen(fname, "w");
+    if (f == NULL) return ERR_OPEN_OUT_FILE;
+    fprintf(f, "NODES %d\nLINKS %d\nSPECIES %d\nPARAMETERS %d\nCONSTANTS %d\nPATTERNS %d\n"
+               "DURATION %ld\nSTEP %ld\nRSTEP %ld\n",
+            Nobj[MSX_NODE], Nobj[MSX_LINK], Nobj[MSX_SPECIES], Nobj[MSX_PARAMETER],
+            Nobj[MSX_CONSTANT], Nobj[MSX_PATTERN], Duration, Qstep, Rstep);
+    fclose(f);
+    return 0;
+}
+
+MSXEXPORT int MSXreport(void)
+{
+    FILE *f;
+    int   i, j, m, p;
+    size_t stride = (size_t)(Nobj[MSX_NODE] + Nobj[MSX_LINK]) * Nobj[MSX_SPECIES];
+
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    f = fopen(RptFile, "w");
+    if (f == NULL) return ERR_OPEN_RPT_FILE;
+    fprintf(f, "  Page 1                                    EPANET-MSX 1.1 (stub)\n\n");
+    for (i = 0; i < 2; i++)
+        for (j = 1; j <= nlocs(i); j++)
+        {
+            fprintf(f, "\n  <<< %s %s%d >>>\n\n", i == MSX_NODE ? "Node" : "Link", prefix(i), j);
+            fprintf(f, "  Time   ");
+            for (m = 1; m <= Nobj[MSX_SPECIES]; m++)
+            {
+                char id[MAXID + 1];
+                snprintf(id, sizeof(id), "S%d", m);
+                fprintf(f, "  %10s", id);
+            }
+            fprintf(f, "\n  hr:min ");
+            for (m = 1; m <= Nobj[MSX_SPECIES]; m++) fprintf(f, "  %10s", "MG/L");
+            fprintf(f, "\n  -------");
+            for (m = 1; m <= Nobj[MSX_SPECIES]; m++) fprintf(f, "  ----------");
+            fprintf(f, "\n");
+            for (p = 0; p < Nperiods; p++)
+            {
+                long t = p * Rstep;
+                const float *r = Results + p * stride;
+                if (i == MSX_LINK) r += (size_t)Nobj[MSX_NODE] * Nobj[MSX_SPECIES];
+                fprintf(f, "  %4ld:%02ld", t / 3600, (t % 3600) / 60);
+                for (m = 1; m <= Nobj[MSX_SPECIES]; m++)
+                    fprintf(f, "  %10.4f", r[(size_t)(m - 1) * nlocs(i) + j - 1]);
+                fprintf(f, "\n");
+            }
+        }
+    fclose(f);
+    return 0;
+}
+
+MSXEXPORT int MSXgetindex(int type, char *id, int *index)
+{
+    const char *p;
+    int i, n;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    *index = 0;
+    if (type == MSX_PATTERN)
+    {
+        for (i = 1; i <= Nobj[MSX_PATTERN]; i++)
+            if (!strcmp(Patterns[i].id, id)) { *index = i; return 0; }
+        return ERR_UNDEFINED_OBJECT_ID;
+    }
+    p = prefix(type);
+    if (p == NULL) return ERR_INVALID_OBJECT_TYPE;
+    if (strncmp(id, p, strlen(p))) return ERR_UNDEFINED_OBJECT_ID;
+    n = atoi(id + strlen(p));
+    if (n < 1 || n > Nobj[type]) return ERR_UNDEFINED_OBJECT_ID;
+    *index = n;
+    return 0;
+}
+
+MSXEXPORT int MSXgetID(int type, int index, char *id, int len)
+{
+    char buf[MAXID + 1];
+    const char *p;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (type < 0 || type > MSX_PATTERN || type == MSX_TANK || type == MSX_TERM)
+        return ERR_INVALID_OBJECT_TYPE;
+    if (index < 1 || index > Nobj[type]) return ERR_INVALID_OBJECT_INDEX;
+    if (type == MSX_PATTERN) snprintf(buf, sizeof(buf), "%s", Patterns[index].id);
+    else
+    {
+        p = prefix(type);
+        snprintf(buf, sizeof(buf), "%s%d", p, index);
+    }
+    strncpy(id, buf, len);
+    id[len] = '\0';
+    return 0;
+}
+
+MSXEXPORT int MSXgetIDlen(int type, int index, int *len)
+{
+    char buf[MAXID + 1];
+    int  err = MSXgetID(type, index, buf, MAXID);
+    *len = err ? 0 : (int)strlen(buf);
+    return err;
+}
+
+MSXEXPORT int MSXgetcount(int type, int *count)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (type < 0 || type > MSX_PATTERN || type == MSX_TERM) return ERR_INVALID_OBJECT_TYPE;
+    *count = Nobj[type];
+    return 0;
+}
+
+MSXEXPORT int MSXgetspecies(int species, int *type, char *units, double *aTol, double *rTol)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (species < 1 || species > Nobj[MSX_SPECIES]) return ERR_INVALID_OBJECT_INDEX;
+    *type = 0;
+    strcpy(units, "MG");
+    *aTol = 1.0e-8;
+    *rTol = 1.0e-3;
+    return 0;
+}
+
+MSXEXPORT int MSXgetconstant(int index, double *value)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (index < 1 || index > Nobj[MSX_CONSTANT]) return ERR_INVALID_OBJECT_INDEX;
+    *value = Const[index];
+    return 0;
+}
+
+MSXEXPORT int MSXgetparameter(int type, int index, int param, double *value)
+{
+    int err;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if ((err = validloc(type, index))) return err;
+    if (param < 1 || param > Nobj[MSX_PARAMETER]) return ERR_INVALID_OBJECT_INDEX;
+    *value = Param[type][index * (Nobj[MSX_PARAMETER] + 1) + param];
+    return 0;
+}
+
+MSXEXPORT int MSXgetsource(int node, int species, int *type, double *level, int *pat)
+{
+    Source *s;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (node < 1 || node > Nobj[MSX_NODE]) return ERR_INVALID_OBJECT_INDEX;
+    if (species < 1 || species > Nobj[MSX_SPECIES]) return ERR_INVALID_OBJECT_INDEX;
+    s = &Sources[node * (Nobj[MSX_SPECIES] + 1) + species];
+    *type = s->type;
+    *level = s->level;
+    *pat = s->pat;
+    return 0;
+}
+
+MSXEXPORT int MSXgetpatternlen(int pat, int *len)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (pat < 1 || pat > Nobj[MSX_PATTERN]) return ERR_INVALID_OBJECT_INDEX;
+    *len = Patterns[pat].length;
+    return 0;
+}
+
+MSXEXPORT int MSXgetpatternvalue(int pat, int period, double *value)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (pat < 1 || pat > Nobj[MSX_PATTERN]) return ERR_INVALID_OBJECT_INDEX;
+    if (period < 1 || period > Patterns[pat].length) return ERR_INVALID_OBJECT_INDEX;
+    *value = Patterns[pat].mult[period - 1];
+    return 0;
+}
+
+MSXEXPORT int MSXgetinitqual(int type, int index, int species, double *value)
+{
+    int err;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if ((err = validloc(type, index))) return err;
+    if (species < 1 || species > Nobj[MSX_SPECIES]) return ERR_INVALID_OBJECT_INDEX;
+    *value = Init[type][index * (Nobj[MSX_SPECIES] + 1) + species];
+    return 0;
+}
+
+MSXEXPORT int MSXgetqual(int type, int index, int species, double *value)
+{
+    int err;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if ((err = validloc(type, index))) return err;
+    if (species < 1 || species > Nobj[MSX_SPECIES]) return ERR_INVALID_OBJECT_INDEX;
+    *value = Qual[type][index * (Nobj[MSX_SPECIES] + 1) + species];
+    return 0;
+}
+
+MSXEXPORT int MSXgeterror(int code, char *msg, int len)
+{
+    snprintf(msg, len, "Error %d - stub MSX library error", code);
+    return 0;
+}
+
+MSXEXPORT int MSXsetconstant(int index, double value)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (index < 1 || index > Nobj[MSX_CONSTANT]) return ERR_INVALID_OBJECT_INDEX;
+    Const[index] = value;
+    return 0;
+}
+
+MSXEXPORT int MSXsetparameter(int type, int index, int param, double value)
+{
+    int err;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if ((err = validloc(type, index))) return err;
+    if (param < 1 || param > Nobj[MSX_PARAMETER]) return ERR_INVALID_OBJECT_INDEX;
+    Param[type][index * (Nobj[MSX_PARAMETER] + 1) + param] = value;
+    return 0;
+}
+
+MSXEXPORT int MSXsetinitqual(int type, int index, int species, double value)
+{
+    int err;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if ((err = validloc(type, index))) return err;
+    if (species < 1 || species > Nobj[MSX_SPECIES]) return ERR_INVALID_OBJECT_INDEX;
+    Init[type][index * (Nobj[MSX_SPECIES] + 1) + species] = value;
+    return 0;
+}
+
+MSXEXPORT int MSXsetsource(int node, int species, int type, double level, int pat)
+{
+    Source *s;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (node < 1 || node > Nobj[MSX_NODE]) return ERR_INVALID_OBJECT_INDEX;
+    if (species < 1 || species > Nobj[MSX_SPECIES]) return ERR_INVALID_OBJECT_INDEX;
+    if (type < -1 || type > 3) return ERR_INVALID_OBJECT_PARAMS;
+    if (pat < 0 || pat > Nobj[MSX_PATTERN]) return ERR_INVALID_OBJECT_INDEX;
+    s = &Sources[node * (Nobj[MSX_SPECIES] + 1) + species];
+    s->type = type;
+    s->level = level;
+    s->pat = pat;
+    return 0;
+}
+
+MSXEXPORT int MSXsetpattern(int pat, double mult[], int len)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (pat < 1 || pat > Nobj[MSX_PATTERN]) return ERR_INVALID_OBJECT_INDEX;
+    if (len < 0) len = 0;
+    free(Patterns[pat].mult);
+    Patterns[pat].mult = malloc((len > 0 ? len : 1) * sizeof(double));
+    memcpy(Patterns[pat].mult, mult, len * sizeof(double));
+    Patterns[pat].length = len;
+    return 0;
+}
+
+MSXEXPORT int MSXsetpatternvalue(int pat, int period, double value)
+{
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    if (pat < 1 || pat > Nobj[MSX_PATTERN]) return ERR_INVALID_OBJECT_INDEX;
+    if (period < 1 || period > Patterns[pat].length) return ERR_INVALID_OBJECT_INDEX;
+    Patterns[pat].mult[period - 1] = value;
+    return 0;
+}
+
+MSXEXPORT int MSXaddpattern(char *id)
+{
+    Pattern *p;
+    int i;
+    if (!Open) return ERR_MSX_NOT_OPENED;
+    for (i = 1; i <= Nobj[MSX_PATTERN]; i++)
+        if (!strcmp(Patterns[i].id, id)) return 0;
+    p = realloc(Patterns, (Nobj[MSX_PATTERN] + 2) * sizeof(Pattern));
+    if (p == NULL) return 501;
+    Patterns = p;
+    Nobj[MSX_PATTERN]++;
+    p = &Patterns[Nobj[MSX_PATTERN]];
+    p->length = 0;
+    p->mult = NULL;
+    snprintf(p->id, MAXID + 1, "%s", id);
+    return 0;
+}
@@ -4,6 +4,25 @@ import ctypes
 import platform
 import datetime
 import os
+import mmap
+import struct
+import asyncio
+import re
+import collections
+import hashlib
+import importlib.util
+import itertools
+import shutil
+import tempfile
+import concurrent.futures
+from multiprocessing import shared_memory, resource_tracker
+import operator
+import functools
+import inspect
+import json
+import time
+import weakref
+import numpy as np
 
 '''
 LIST OF FUNCTIONS:
@@ -14,15 +33,21 @@ msx.MSXsetpatternvalue(pattern_index,time_index,value)
 msx.MSXsetconstant(constant_index,value)
 msx.MSXsetparameter(location_type,location_index,parameter_index,value)
 msx.MSXsetinitqual(location_type,location_index,species_index,value)
+msx.MSXsetparameterarray(location_type,parameter_index,values)
+msx.MSXsetinitqualarray(location_type,species_index,values)
 msx.MSXsetsource(node_index,species_index,source_type,value,pattern_index)
 index = msx.MSXgetindex(object_type,object_label)
 label = msx.MSXgetID(object_type,object_index)
+labels = msx.MSXgetIDs(object_type)
 length = msx.MSXgetIDlen(object_type,object_index)
 initqual = msx.MSXgetinitqual(location_type,location_index,species_index)
 qual = msx.MSXgetqual(location_type,location_ind,species_ind)
+quals = msx.MSXgetqualarray(location_type,[species_index],[location_indices],[out])
 constant = msx.MSXgetconstant(constant_index)
 parameter = msx.MSXgetparameter(location_type,location_index,parameter_index)
 [type,value,pattern] = msx.MSXgetsource(node_index,species_index)
+sources = msx.MSXgetsourcearray(); msx.MSXsetsourcearray(sources,[previous])
+patterns = msx.MSXgetpatterns(); msx.MSXsetpatterns(patterns,[previous])
 length = msx.MSXgetpatternlen(pattern_index)
 value = msx.MSXgetpatternvalue(pattern_index,time_index)
 [type,units,aTol,rTol] = msx.MSXgetspecies(species_index)
@@ -30,12 +55,25 @@ count = msx.MSXgetcount(object_index)
 msx.MSXusehydfile(hydfile)
 msx.MSXinit()
 [t,t_left] = msx.MSXstep()
+for t,quals in msx.MSXsteps(location_type,[species_index],[location_indices],[size],[out]): ...
+result = msx.MSXdetect([(location_type,species_index,op,threshold,[location_indices])],[stop])
 msx.MSXsolveH()
 msx.MSXsolveQ()
 msx.MSXreport()
 msx.MSXsaveoutfile(binfile)
 msx.MSXsavemsxfile(new_msx_inpfile)
 msx.MSXclose()
+out = msx.MSXoutfile(binfile)
+msx.MSXsavestate(state_file,msx_file,t); t = msx.MSXloadstate(state_file,msx_file)
+cache = msx.MSXhydcache(directory,[maxbytes],[maxfiles]); cache.use(cache.key(inp_file),save_hydfile)
+tables = msx.MSXreadreport(report_file,[node_ids],[link_ids])
+rec = msx.MSXrecorder(folder,[node_indices],[link_indices],[species_indices],[every],[interval]); rec.run(); rec.close()
+columns = msx.MSXreadrecording(folder,[column_names])
+project = msx.MSXproject([library]); project.MSXopen(msx_file); ...; project.close()
+sim = msx.MSXasync(); [t,t_left] = await sim.step(); qual = await sim.get(msx.MSXgetqual,location_type,location_ind,species_ind)
+msx.MSXprofile([enable]); stats = msx.MSXprofilestats(); text = msx.MSXprofilejson([fname]); msx.MSXprofilereset()
+scenarios = msx.MSXscenarios(); scenarios.apply(scenario); scenarios.revert()
+for result in msx.MSXensemble(msx_file,[scenarios],location_type,[species_index],[location_indices]): ...
 
  // MSX constants
 # object type
@@ -61,7 +99,13 @@ MSX_FLOWPACED  3
 # os.chdir('C:\Users\User1\Dropbox (MIT)\\2018 Mekorot\Python EPANET wrapper\epanet-module')
 # ctypes.windll.kernel1.SetDllDirectoryW(None)
 _plat= platform.system()
-if _plat=='Windows':
+_lib = globals().get('_lib')  # already set in the private copies of this module made by MSXproject
+if _lib is not None:
+    pass
+elif os.environ.get('EPANETMSX_LIBRARY'):
+    # explicit build of the library, e.g. for benchmarking
+    _lib = ctypes.CDLL(os.environ['EPANETMSX_LIBRARY'])
+elif _plat=='Windows':
     os.environ['PATH'] = os.path.dirname(__file__) + ';' + os.environ['PATH']
     try:
         # if epanetmsx.dll compiled with __cdecl (as in OpenWaterAnalytics)
@@ -76,6 +120,84 @@ if _plat=='Windows':
 else:
     Exception('Platform '+ _plat +' unsupported (not yet)')
 
+#----------binding layer----------------------------------------------------------------
+# object type codes accepted by each group of functions, by name or by value
+_LOCATION_TYPES = {'MSX_NODE':0, 'MSX_LINK':1}
+_OBJECT_TYPES = {'MSX_SPECIES':3, 'MSX_PARAMETER':5, 'MSX_CONSTANT':6, 'MSX_PATTERN':7}
+_COUNT_TYPES = dict(_LOCATION_TYPES, **_OBJECT_TYPES)
+_SOURCE_TYPES = {'MSX_NOSOURCE':-1, 'MSX_CONCEN':0, 'MSX_MASS':1, 'MSX_SETPOINT':2, 'MSX_FLOWPACED':3}
+for _types in (_LOCATION_TYPES,_OBJECT_TYPES,_COUNT_TYPES,_SOURCE_TYPES):
+    _types.update({code:code for code in list(_types.values())})
+
+_c_int_p = ctypes.POINTER(ctypes.c_int)
+_c_long_p = ctypes.POINTER(ctypes.c_long)
+_c_double_p = ctypes.POINTER(ctypes.c_double)
+_c_int = ctypes.c_int
+_c_double = ctypes.c_double
+_index = operator.index
+
+# argument types of the toolkit functions; they all return an int error code.
+# Declared argtypes cost a from_param conversion per argument on every call (about doubling the cost of a
+# getter or setter), so functions taking only ints, doubles and pointers are called without them: ctypes'
+# default conversion of Python ints and byref() objects is exactly right for those, the wrappers pass
+# integer arguments through operator.index (so NumPy integers keep working) and wrap doubles in c_double.
+_SIGNATURES = {
+    'MSXopen': (ctypes.c_char_p,),
+    'MSXclose': (),
+    'MSXusehydfile': (ctypes.c_char_p,),
+    'MSXsolveH': (),
+    'MSXinit': (_c_int,),
+    'MSXsolveQ': (),
+    'MSXstep': (_c_long_p,_c_long_p),
+    'MSXsaveoutfile': (ctypes.c_char_p,),
+    'MSXsavemsxfile': (ctypes.c_char_p,),
+    'MSXreport': (),
+    'MSXgetindex': (_c_int,ctypes.c_char_p,_c_int_p),
+    'MSXgetIDlen': (_c_int,_c_int,_c_int_p),
+    'MSXgetID': (_c_int,_c_int,ctypes.c_char_p,_c_int),
+    'MSXgetinitqual': (_c_int,_c_int,_c_int,_c_double_p),
+    'MSXgetqual': (_c_int,_c_int,_c_int,_c_double_p),
+    'MSXgetconstant': (_c_int,_c_double_p),
+    'MSXgetparameter': (_c_int,_c_int,_c_int,_c_double_p),
+    'MSXgetsource': (_c_int,_c_int,_c_int_p,_c_double_p,_c_int_p),
+    'MSXgetpatternlen': (_c_int,_c_int_p),
+    'MSXgetpatternvalue': (_c_int,_c_int,_c_double_p),
+    'MSXgetcount': (_c_int,_c_int_p),
+    'MSXgetspecies': (_c_int,_c_int_p,ctypes.c_char_p,_c_double_p,_c_double_p),
+    'MSXgeterror': (_c_int,ctypes.c_char_p,_c_int),
+    'MSXsetconstant': (_c_int,_c_double),
+    'MSXsetparameter': (_c_int,_c_int,_c_int,_c_double),
+    'MSXsetinitqual': (_c_int,_c_int,_c_int,_c_double),
+    'MSXsetsource': (_c_int,_c_int,_c_int,_c_double,_c_int),
+    'MSXsetpattern': (_c_int,_c_double_p,_c_int),
+    'MSXsetpatternvalue': (_c_int,_c_int,_c_double),
+    'MSXaddpattern': (ctypes.c_char_p,),
+}
+
+# reusable out-parameters (the library holds global state, so calls are never concurrent)
+_int1 = ctypes.c_int(); _int1ref = ctypes.byref(_int1)
+_int2 = ctypes.c_int(); _int2ref = ctypes.byref(_int2)
+_dbl1 = ctypes.c_double(); _dbl1ref = ctypes.byref(_dbl1)
+_dbl2 = ctypes.c_double(); _dbl2ref = ctypes.byref(_dbl2)
+_long1 = ctypes.c_long(); _long1ref = ctypes.byref(_long1)
+_long2 = ctypes.c_long(); _long2ref = ctypes.byref(_long2)
+_MAXID = 32
+_idbuf = ctypes.create_string_buffer(_MAXID)
+_unitsbuf = ctypes.create_string_buffer(16)
+
+def _bind():
+    """Binds every toolkit function of _lib, with its declared signature, to the module global _<name>
+    so the wrappers skip the attribute lookup and the argument conversion is set up once"""
+    g = globals()
+    for name,argtypes in _SIGNATURES.items():
+        func = _lib[name]  # a fresh function object, leaving _lib.<name> as it was
+        func.restype = ctypes.c_int
+        if not all(a is _c_int or a is _c_double or issubclass(a,ctypes._Pointer) for a in argtypes):
+            func.argtypes = argtypes
+        g['_'+name] = func
+
+if _lib is not None:
+    _bind()
 
 #----------running the simulation-----------------------------------------------------
 def MSXopen(nomeinp):
@@ -83,132 +205,265 @@ def MSXopen(nomeinp):
     Arguments:
     nomeinp: name of the msx input file
     """
-    ierr= _lib.MSXopen(ctypes.c_char_p(nomeinp.encode()))
+    _names.clear()
+    ierr= _MSXopen(nomeinp.encode())
     if ierr!=0: raise MSXtoolkitError(ierr)
 
 def MSXclose():
   """Closes down the Toolkit system (including all files being processed)"""
-  ierr= _lib.MSXclose()
+  _names.clear()
+  ierr= _MSXclose()
   if ierr!=0: raise MSXtoolkitError(ierr)
 
 def MSXusehydfile(fname):
     """Uses the contents of the specified file as the current binary hydraulics file"""
-    ierr = _lib.MSXusehydfile(ctypes.c_char_p(fname.encode()))
+    ierr = _MSXusehydfile(fname.encode())
     if ierr != 0: raise MSXtoolkitError(ierr)
 
 def MSXsolveH():
     """Runs a complete hydraulic simulation with results
     for all time periods written to the binary Hydraulics file."""
-    ierr = _lib.MSXsolveH()
+    ierr = _MSXsolveH()
     if ierr != 0: raise MSXtoolkitError(ierr)
 
 def MSXinit(saveFlag=0):
     """Initializes the MSX system before solving for water quality results in step-wise fashion
     set saveFlag to 1 if water quality results should be saved to a scratch binary file, or to 0 is not saved to file"""
-    ierr = _lib.MSXinit(saveFlag)
+    ierr = _MSXinit(saveFlag)
     if ierr != 0: raise MSXtoolkitError(ierr)
 
 def MSXsolveQ():
     """solves for water quality over the entire simulation period and saves the results to an internal scratch file"""
-    ierr = _lib.MSXsolveQ()
+    ierr = _MSXsolveQ()
     if ierr != 0: raise MSXtoolkitError(ierr)
 
 def MSXstep():
     """Advances the water quality simulation one water quality time step.
     The time remaining in the overall simulation is returned as tleft, the current time as t."""
-    t = ctypes.c_long()
-    tleft = ctypes.c_long()
-    ierr = _lib.MSXstep(ctypes.byref(t),ctypes.byref(tleft))
+    ierr = _MSXstep(_long1ref,_long2ref)
     if ierr != 0: raise MSXtoolkitError(ierr)
-    out = [t.value, tleft.value]
+    out = [_long1.value, _long2.value]
     return out
 
+def MSXsteps(type,spe=None,ind=None,size=1,out=None,init=True,saveFlag=0):
+    """Generator that steps the water quality simulation to its end, yielding (t, quals) after every time step
+    quals holds the concentrations at the selected nodes or links, laid out as in MSXgetqualarray, and is a view
+    into a ring buffer of size slots that is overwritten in turn: memory stays constant however long the run is,
+    and a view stays valid for the next size-1 steps. Copy it if it has to outlive that.
+    Arguments:
+    type is type of object: MSX_NODE (0), MSX_LINK (1)
+    spe is the sequence number of the species (starting from 1), a sequence of them, or None for all species
+    ind is an optional sequence of node or link indices (starting from 1); all nodes or links if None
+    size is the number of slots in the ring buffer (ignored if out is given)
+    out is an optional caller-supplied C-contiguous float64 ring buffer whose first axis is the number of slots
+    init set to False to continue a simulation already initialized with MSXinit
+    saveFlag is passed on to MSXinit"""
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    if ind is None:
+        ind = range(1,MSXgetcount(type_ind)+1)
+    if spe is None:
+        species = range(1,MSXgetcount(3)+1)
+        shape = (len(ind),len(species))
+    elif np.ndim(spe) == 0:
+        species = (spe,)
+        shape = (len(ind),)
+    else:
+        species = tuple(spe)
+        shape = (len(ind),len(species))
+    if out is None:
+        out = np.empty((size,)+shape)
+    elif out.shape[1:] != shape or out.dtype != np.float64 or not out.flags.c_contiguous or len(out) == 0:
+        raise ValueError('out must be a C-contiguous float64 array of shape (slots,)+'+str(shape))
+    # one set of pointers into a staging slot, copied into the ring after every step: a pointer table per slot
+    # would take far more memory than the ring itself
+    stage = np.empty(shape)
+    refs = _qualrefs(stage,ind,species)
+    if init: MSXinit(saveFlag)
+    t = ctypes.c_long()
+    tleft = ctypes.c_long()
+    tref = ctypes.byref(t)
+    tleftref = ctypes.byref(tleft)
+    k = 0
+    while True:
+        ierr = _MSXstep(tref,tleftref)
+        if ierr != 0: raise MSXtoolkitError(ierr)
+        _getquals(type_ind,refs)
+        np.copyto(out[k],stage)
+        yield t.value, out[k]
+        if tleft.value <= 0: break
+        k += 1
+        if k == len(out): k = 0
+
+# comparisons accepted by MSXdetect
+_DETECT_OPS = {'<':np.less, '<=':np.less_equal, '>':np.greater, '>=':np.greater_equal}
+
+MSXdetection = collections.namedtuple('MSXdetection','crossings t tleft')
+MSXdetection.__doc__ = """Result of MSXdetect
+crossings: one float64 array per condition with the first time (s) each of its locations met it, NaN if never
+t, tleft: simulation time and time left after the last step taken (tleft is None if no step was needed)"""
+
+def MSXdetect(conditions,stop='all',init=True,saveFlag=0):
+    """Steps the water quality simulation only until threshold events are resolved, recording when each location
+    first meets its condition (e.g. chlorine below 0.2 or contaminant arrival). After every step only the locations
+    still pending are read, and each condition is checked with one vectorized comparison.
+    Arguments:
+    conditions: sequence of (type, spe, op, threshold) or (type, spe, op, threshold, ind) where type is MSX_NODE (0)
+    or MSX_LINK (1), spe the species index, op one of '<', '<=', '>', '>=' and ind an optional sequence of
+    node or link indices (starting from 1); all nodes or links if omitted or None
+    stop: 'all' stops once every location of every condition has met it, 'any' as soon as one location meets
+    its condition, None runs to the end of the simulation
+    init set to False to continue a simulation already initialized with MSXinit (the initial state is then not checked)
+    saveFlag is passed on to MSXinit
+    returns MSXdetection(crossings, t, tleft)"""
+    if stop not in ('all','any',None): raise ValueError("stop must be 'all', 'any' or None")
+    states = []
+    for cond in conditions:
+        type,spe,op,threshold = cond[:4]
+        ind = cond[4] if len(cond) > 4 else None
+        type_ind = _LOCATION_TYPES.get(type)
+        if type_ind is None: raise Exception('unrecognized type')
+        compare = _DETECT_OPS.get(op)
+        if compare is None: raise ValueError('unrecognized operator '+repr(op))
+        if ind is None:
+            ind = range(1,MSXgetcount(type_ind)+1)
+        ind = np.array(ind,dtype=np.int64).reshape(-1)
+        pending = np.arange(len(ind))
+        quals = np.empty(len(ind))
+        # [type, species, comparison, threshold, indices, first times, pending rows, buffer, pointers]
+        states.append([type_ind,_index(spe),compare,threshold,ind,np.full(len(ind),np.nan),pending,quals,
+                       _qualrefs(quals,ind,(spe,))])
+    t = ctypes.c_long()
+    tleft = ctypes.c_long()
+    if init:
+        MSXinit(saveFlag)
+        hit = _detectstep(states,0)
+    else:
+        hit = False
+    tref = ctypes.byref(t)
+    tleftref = ctypes.byref(tleft)
+    stepped = False
+    # while MSXprofile is on, account every step (and its checks) as the MSXsteps wrapper does
+    profiling = bool(_profile_originals)
+    clock = time.perf_counter
+    while not (stop == 'any' and hit) and not (stop == 'all' and all(len(st[6]) == 0 for st in states)):
+        if profiling: t0 = clock()
+        ierr = _MSXstep(tref,tleftref)
+        if ierr != 0: raise MSXtoolkitError(ierr)
+        stepped = True
+        hit = _detectstep(states,t.value)
+        if profiling: _stepped(t.value,clock()-t0)
+        if tleft.value <= 0: break
+    return MSXdetection([st[5] for st in states],t.value,tleft.value if stepped else None)
+
+def _detectstep(states,t):
+    """Checks the pending locations of every MSXdetect condition at time t; returns True if any met its condition"""
+    found = False
+    for st in states:
+        type_ind,spe,compare,threshold,ind,first,pending,quals,refs = st
+        if len(pending) == 0: continue
+        _getquals(type_ind,refs)
+        hit = compare(quals,threshold)
+        if hit.any():
+            found = True
+            first[pending[hit]] = t
+            st[6] = pending = pending[~hit]
+            st[7] = quals = np.empty(len(pending))
+            st[8] = _qualrefs(quals,ind[pending],(spe,))
+    return found
+
 def MSXsaveoutfile(fname):
     """saves water quality results computed for each node, link and reporting time period to a named binary file"""
-    ierr = _lib.MSXsaveoutfile(ctypes.c_char_p(fname.encode()))
+    ierr = _MSXsaveoutfile(fname.encode())
     if ierr != 0: raise MSXtoolkitError(ierr)
 
 def MSXsavemsxfile(fname):
     """saves the data associated with the current MSX project into a new MSX input file"""
-    ierr = _lib.MSXsavemsxfile(ctypes.c_char_p(fname.encode()))
+    ierr = _MSXsavemsxfile(fname.encode())
     if ierr != 0: raise MSXtoolkitError(ierr)
 
 def MSXreport():
     """ Writes water quality simulations results as instructed by the MSX input file to a text file"""
-    ierr = _lib.MSXreport()
+    ierr = _MSXreport()
     if ierr != 0: raise MSXtoolkitError(ierr)
 
 #---------get parameters---------------------------------------------------------------
 def MSXgetindex(type,name):
     """Retrieves the internal index of an MSX object given its name.
+    Names are looked up in the project's ID table (see MSXgetIDs), built once per type.
     Arguments:
     type (int)
+    MSX_NODE - 0 (for a network node)
+    MSX_LINK - 1 (for a network link)
     MSX_SPECIES - 3 (for a chemical species)
     MSX_CONSTANT - 6 (for a reaction constant
     MSX_PARAMETER - 5 (for a reaction parameter)
     MSX_PATTERN - 7 (for a time pattern)"""
-    type_ind = 100  # in case the type input is in text
-    if type == 'MSX_SPECIES' or type == 3:
-        type_ind = 3
-    if type == 'MSX_CONSTANT' or type == 6:
-        type_ind = 6
-    if type == 'MSX_PARAMETER' or type == 5:
-        type_ind = 5
-    if type == 'MSX_PATTERN' or type == 7:
-        type_ind = 7
-    if type_ind == 100: raise Exception('unrecognized type')
-    ind = ctypes.c_int()
-    ierr= _lib.MSXgetindex(type_ind,ctypes.c_char_p(name.encode()),ctypes.byref(ind))
+    type_ind = _COUNT_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    table = _names.get(type_ind) or _loadnames(type_ind)
+    ind = table[1].get(name)
+    if ind is not None: return ind
+    # not in the table: let the library report the error
+    ierr= _MSXgetindex(type_ind,name.encode(),_int1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return ind.value
+    return _int1.value
 
 def MSXgetIDlen(type,index):
     """Retrieves the number of characters in the ID name of an MSX object given its internal index number.
     Arguments:
     type - int:
+    MSX_NODE - 0 (for a network node)
+    MSX_LINK - 1 (for a network link)
     MSX_SPECIES - 3 (for a chemical species)
     MSX_CONSTANT - 6 (for a reaction constant
     MSX_PARAMETER - 5 (for a reaction parameter)
     MSX_PATTERN - 7 (for a time pattern)"""
-    type_ind = 100  # in case the type input is in text
-    if type == 'MSX_SPECIES' or type == 3:
-        type_ind = 3
-    if type == 'MSX_CONSTANT' or type == 6:
-        type_ind = 6
-    if type == 'MSX_PARAMETER' or type == 5:
-        type_ind = 5
-    if type == 'MSX_PATTERN' or type == 7:
-        type_ind = 7
-    if type_ind == 100: raise Exception('unrecognized type')
-    len = ctypes.c_int()
-    ierr= _lib.MSXgetIDlen(type_ind,ctypes.c_int(index),ctypes.byref(len))
-    if ierr!=0: raise MSXtoolkitError(ierr)
-    return len.value
+    return len(MSXgetID(type,index))
 
 def MSXgetID(type,index):
     """Retrieves the ID name of an object given its internal index number
+    IDs are read from the project's ID table (see MSXgetIDs), built once per type.
     Arguments:
     type:
+    MSX_NODE - 0 (for a network node)
+    MSX_LINK - 1 (for a network link)
     MSX_SPECIES - 3 (for a chemical species)
     MSX_CONSTANT - 6 (for a reaction constant
     MSX_PARAMETER - 5 (for a reaction parameter)
     MSX_PATTERN - 7 (for a time pattern)
     maxlen: maxi number of characters that id can hold not counting null termination character"""
-    type_ind = 100  # in case the type input is in text
-    if type == 'MSX_SPECIES' or type == 3:
-        type_ind = 3
-    if type == 'MSX_CONSTANT' or type == 6:
-        type_ind = 6
-    if type == 'MSX_PARAMETER' or type == 5:
-        type_ind = 5
-    if type == 'MSX_PATTERN' or type == 7:
-        type_ind = 7
-    if type_ind == 100: raise Exception('unrecognized type')
-    maxlen = 32
-    id = ctypes.create_string_buffer(maxlen)
-    ierr= _lib.MSXgetID(type_ind,ctypes.c_int(index),ctypes.byref(id),ctypes.c_int(maxlen-1))
+    type_ind = _COUNT_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    ids = (_names.get(type_ind) or _loadnames(type_ind))[0]
+    if 0 < index <= len(ids): return ids[index-1]
+    # out of range: let the library report the error
+    ierr= _MSXgetID(type_ind,index,_idbuf,_MAXID-1)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return id.value
+    return _idbuf.value
+
+def MSXgetIDs(type):
+    """Retrieves the ID names of all objects of a type, as a tuple in which the object of index i is at position i-1
+    The tuple is the project's ID table: it is read from the library on first use of a type and kept until
+    MSXopen or MSXclose (MSXaddpattern refreshes the pattern IDs).
+    Arguments:
+    type: MSX_NODE (0), MSX_LINK (1), MSX_SPECIES (3), MSX_PARAMETER (5), MSX_CONSTANT (6), MSX_PATTERN (7)"""
+    type_ind = _COUNT_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    return (_names.get(type_ind) or _loadnames(type_ind))[0]
+
+# ID tables of the open project: type code -> (IDs by index-1, {ID string: index})
+_names = {}
+
+def _loadnames(type_ind):
+    ids = []
+    for i in range(1,MSXgetcount(type_ind)+1):
+        ierr= _MSXgetID(type_ind,i,_idbuf,_MAXID-1)
+        if ierr!=0: raise MSXtoolkitError(ierr)
+        ids.append(_idbuf.value)
+    table = (tuple(ids),{id.decode():i for i,id in enumerate(ids,1)})
+    _names[type_ind] = table
+    return table
 
 def MSXgetinitqual(type,ind,spe):
     """Retrieves the initial concentration of a particular chemical species assigned to a specific node
@@ -217,16 +472,11 @@ def MSXgetinitqual(type,ind,spe):
     type is type of object: MSX_NODE (0), MSX_LINK (1)
     ind is the internal sequence number (starting from 1) assigned to the node or link
     speicies is the sequence number of teh species (starting  from 1)"""
-    type_ind = 100
-    if type == 'MSX_NODE' or type == 0:
-        type_ind = 0
-    if type == 'MSX_LINK' or type == 1:
-        type_ind = 1
-    if type_ind == 100: raise Exception('unrecognized type')
-    iniqual = ctypes.c_double()
-    ierr= _lib.MSXgetinitqual(ctypes.c_int(type_ind),ctypes.c_int(ind),ctypes.c_int(spe),ctypes.byref(iniqual))
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    ierr= _MSXgetinitqual(type_ind,_index(ind),_index(spe),_dbl1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return iniqual.value
+    return _dbl1.value
 
 def MSXgetqual(type,ind,spe):
     """Retrieves a chemical species concentration at a given node or the average concentration along a link at the current simulation time step
@@ -235,25 +485,84 @@ def MSXgetqual(type,ind,spe):
     ind is the internal sequence number (starting from 1) assigned to the node or link
     speicies is the sequence number of teh species (starting  from 1)
     concentrations expressed as: mass units per liter for bulk species and mass per unit area for surface species"""
-    type_ind = 100
-    if type == 'MSX_NODE' or type == 0:
-        type_ind = 0
-    if type == 'MSX_LINK' or type == 1:
-        type_ind = 1
-    if type_ind == 100: raise Exception('unrecognized type')
-    qual = ctypes.c_double()
-    ierr= _lib.MSXgetqual(ctypes.c_int(type_ind),ctypes.c_int(ind),ctypes.c_int(spe),ctypes.byref(qual))
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    ierr= _MSXgetqual(type_ind,_index(ind),_index(spe),_dbl1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return qual.value
+    return _dbl1.value
+
+def MSXgetqualarray(type,spe=None,ind=None,out=None):
+    """Retrieves the concentrations at every node or link (or at a subset of them) at the current simulation time step
+    Arguments:
+    type is type of object: MSX_NODE (0), MSX_LINK (1)
+    spe is the sequence number of the species (starting from 1), or None for all species
+    ind is an optional sequence of node or link indices (starting from 1); all nodes or links if None
+    out is an optional C-contiguous float64 array the results are written into; the pointers into it are prepared
+    once and reused by later calls with the same out, type, species and indices, so a step loop allocates nothing;
+    its shape must be (number of locations,) for a single species or (number of locations, number of species) for all species
+    returns out (or a new array of that shape): row i holds the location ind[i] (node or link i+1 if ind is None)"""
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    if ind is None:
+        ind = range(1,MSXgetcount(type_ind)+1)
+    if spe is None:
+        species = range(1,MSXgetcount(3)+1)
+        shape = (len(ind),len(species))
+    else:
+        species = (spe,)
+        shape = (len(ind),)
+    if out is None:
+        out = np.empty(shape)
+        _getquals(type_ind,_qualrefs(out,ind,species))
+        return out
+    if out.shape != shape or out.dtype != np.float64 or not out.flags.c_contiguous:
+        raise ValueError('out must be a C-contiguous float64 array of shape '+str(shape))
+    key = (out.ctypes.data,shape,type_ind,spe)
+    entry = _qualcache.get(key)
+    if entry is None or not _sameind(entry[0],ind):
+        entry = (ind if isinstance(ind,range) else np.array(ind),_qualrefs(out,ind,species))
+        _qualcache[key] = entry
+        if len(_qualcache) > _QUALCACHE_SIZE: _qualcache.popitem(last=False)
+    else:
+        _qualcache.move_to_end(key)
+    _getquals(type_ind,entry[1])
+    return out
+
+# pointers prepared by the latest MSXgetqualarray calls with out, by (address, shape, type, species);
+# an entry keeps its out array alive, so the address cannot be reused by another array
+_qualcache = collections.OrderedDict()
+_QUALCACHE_SIZE = 8
+
+def _sameind(saved,ind):
+    """True if the indices ind are those a _qualcache entry was prepared for"""
+    if isinstance(saved,range): return isinstance(ind,range) and saved == ind
+    return not isinstance(ind,range) and len(saved) == len(ind) and np.array_equal(saved,ind)
+
+def _qualrefs(out,ind,species):
+    """Pairs every (location, species) with a pointer into out, in C order, so that MSXgetqual writes straight into the array"""
+    buf = (ctypes.c_double*out.size).from_buffer(out)
+    refs = []
+    offset = 0
+    for i in ind:
+        for s in species:
+            refs.append((_index(i),_index(s),ctypes.byref(buf,offset)))
+            offset += 8
+    return refs
+
+def _getquals(type_ind,refs):
+    """Fills the pointers prepared by _qualrefs with the current concentrations"""
+    getqual = _MSXgetqual
+    for i,s,ref in refs:
+        ierr = getqual(type_ind,i,s,ref)
+        if ierr!=0: raise MSXtoolkitError(ierr)
 
 def MSXgetconstant(ind):
     """Retrieves the value of a particular reaction constant
     Arguments:
     ind is the sequence number of the reaction constant (starting from 1) as it appeared in the MSX input file"""
-    const = ctypes.c_double()
-    ierr= _lib.MSXgetconstant(ind,ctypes.byref(const))
+    ierr= _MSXgetconstant(_index(ind),_dbl1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return const.value
+    return _dbl1.value
 
 
 def MSXgetparameter(type,ind,param_ind):
@@ -262,16 +571,11 @@ def MSXgetparameter(type,ind,param_ind):
     type is the type of object: MSX_NODE (0) or MSX_LINK (1)
     ind is the internal sequence number(starting from 1) assigned to the node or link
     param is the sequence number of the parameter (starting from 1 as listed in the MSX input file)"""
-    type_ind = 100  # in case type input is in text
-    if type == 'MSX_NODE' or type == 0:
-        type_ind = 0
-    if type == 'MSX_LINK' or type == 1:
-        type_ind = 1
-    if type_ind == 100: raise Exception('unrecognized type')
-    param = ctypes.c_double()
-    ierr= _lib.MSXgetparameter(ctypes.c_int(type_ind),ctypes.c_int(ind),ctypes.c_int(param_ind),ctypes.byref(param))
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    ierr= _MSXgetparameter(type_ind,_index(ind),_index(param_ind),_dbl1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return param.value
+    return _dbl1.value
 
 def MSXgetsource(node,spe):
     """Retrieves information on any external source of a particular chemical species assigned to a specific node of the pipe network
@@ -283,22 +587,18 @@ def MSXgetsource(node,spe):
     MSX_SETPOINT (2) setpoint source; MSX_FLOWPACED (3) flow paced source
     level is returned with the baseline concentration (or mass flow rate) of the source
     pat is returned with the index of the time pattern used to add variability to the source's baseline level (0 if no pattern defined for the source)"""
-    level = ctypes.c_double()
-    type = ctypes.c_int()
-    pat = ctypes.c_int()
-    ierr = _lib.MSXgetsource(ctypes.c_int(node),ctypes.c_int(spe),ctypes.byref(type),ctypes.byref(level),ctypes.byref(pat))
+    ierr = _MSXgetsource(_index(node),_index(spe),_int1ref,_dbl1ref,_int2ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    src_out = [type.value,level.value,pat.value]
+    src_out = [_int1.value,_dbl1.value,_int2.value]
     return src_out
 
 def MSXgetpatternlen(pat):
     """Retrieves the number of time periods within a SOURCE time pattern
     Arguments:
     pat is the internal sequence number (starting from 1) of the pattern as appears in the MSX input file"""
-    len = ctypes.c_int()
-    ierr = _lib.MSXgetpatternlen(pat,ctypes.byref(len))
+    ierr = _MSXgetpatternlen(_index(pat),_int1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return len.value
+    return _int1.value
 
 def MSXgetpatternvalue(pat,period):
     """Retrieves the multiplier at a specific time period for a given SOURCE time pattern
@@ -306,33 +606,67 @@ def MSXgetpatternvalue(pat,period):
     pat is the internal sequence number (starting from 1) of the pattern as appears in the MSX input file
     period is the index of the time period (starting from 1) whose multiplier is being sought
     value is the vlaue of teh pattern's multiplier in teh desired period"""
-    val = ctypes.c_double()
-    ierr = _lib.MSXgetpatternvalue(pat,period,ctypes.byref(val))
+    ierr = _MSXgetpatternvalue(_index(pat),_index(period),_dbl1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return val.value
+    return _dbl1.value
+
+# row layout of MSXgetsourcearray / MSXsetsourcearray
+MSX_SOURCE_DTYPE = np.dtype([('type',np.int32),('level',np.float64),('pattern',np.int32)])
+
+def MSXgetsourcearray():
+    """Retrieves the external sources of every species at every node at once
+    returns a structured array of shape (number of nodes, number of species) with dtype MSX_SOURCE_DTYPE:
+    fields type (MSX_NOSOURCE (-1), MSX_CONCEN (0), MSX_MASS (1), MSX_SETPOINT (2), MSX_FLOWPACED (3)),
+    level and pattern (0 if none) as in MSXgetsource; row i is node i+1, column s is species s+1"""
+    nnodes = MSXgetcount(0)
+    nspecies = MSXgetcount(3)
+    # fill contiguous field arrays through memoryviews (the cheapest per-item store), then interleave them once
+    fields = {name:np.empty(nnodes*nspecies,dtype=MSX_SOURCE_DTYPE[name]) for name in MSX_SOURCE_DTYPE.names}
+    types,levels,pats = (memoryview(fields[name]) for name in MSX_SOURCE_DTYPE.names)
+    getsource = _MSXgetsource
+    k = 0
+    for i in range(1,nnodes+1):
+        for s in range(1,nspecies+1):
+            ierr = getsource(i,s,_int1ref,_dbl1ref,_int2ref)
+            if ierr!=0: raise MSXtoolkitError(ierr)
+            types[k] = _int1.value
+            levels[k] = _dbl1.value
+            pats[k] = _int2.value
+            k += 1
+    out = np.empty((nnodes,nspecies),dtype=MSX_SOURCE_DTYPE)
+    for name,values in fields.items():
+        out[name] = values.reshape(nnodes,nspecies)
+    return out
+
+def MSXgetpatterns():
+    """Retrieves the multipliers of every SOURCE time pattern at once
+    returns a dict {pattern index (starting from 1): float64 array of its multipliers}"""
+    getvalue = _MSXgetpatternvalue
+    out = {}
+    for pat in range(1,MSXgetcount(7)+1):
+        mult = []
+        for period in range(1,MSXgetpatternlen(pat)+1):
+            ierr = getvalue(pat,period,_dbl1ref)
+            if ierr!=0: raise MSXtoolkitError(ierr)
+            mult.append(_dbl1.value)
+        out[pat] = np.array(mult)
+    return out
 
 def MSXgetcount(type):
     """Retrieves the number of objects of a specified type.
     Arguments:
+    MSX_NODE - 0 (for a network node)
+    MSX_LINK - 1 (for a network link)
     MSX_SPECIES - 3 (for a chemical species)
     MSX_CONSTANT - 6 (for a reaction constant
     MSX_PARAMETER - 5 (for a reaction parameter)
     MSX_PATTERN - 7 (for a time pattern)
     maxlen: maxi number of characters that id can hold not counting null termination character"""
-    type_ind = 100  # in case the type input is in text
-    if type == 'MSX_SPECIES' or type == 3:
-        type_ind = 3
-    if type == 'MSX_CONSTANT' or type == 6:
-        type_ind = 6
-    if type == 'MSX_PARAMETER' or type == 5:
-        type_ind = 5
-    if type == 'MSX_PATTERN' or type == 7:
-        type_ind = 7
-    if type_ind == 100: raise Exception('unrecognized type')
-    count = ctypes.c_int()
-    ierr= _lib.MSXgetcount(type_ind,ctypes.byref(count))
+    type_ind = _COUNT_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    ierr= _MSXgetcount(type_ind,_int1ref)
     if ierr!=0: raise MSXtoolkitError(ierr)
-    return count.value
+    return _int1.value
 
 def MSXgetspecies(spe):
     """Retrieves the attributes of a chemical species given its internal index number.
@@ -341,13 +675,9 @@ def MSXgetspecies(spe):
         units: C_style character string array that is returned with the mass units that were defined for the species in question(hold max 15 characters)
         aTol returned with absolute concentration tolerance defined for the species
         rTol returned with the relative concentration tolerance defined for the species"""
-    type_ind = ctypes.c_int()
-    units = ctypes.create_string_buffer(15)
-    aTol = ctypes.c_double()
-    rTol = ctypes.c_double()
-    ierr = _lib.MSXgetspecies(spe,ctypes.byref(type_ind),ctypes.byref(units),ctypes.byref(aTol),ctypes.byref(rTol))
+    ierr = _MSXgetspecies(spe,_int1ref,_unitsbuf,_dbl1ref,_dbl2ref)
     if ierr != 0: raise MSXtoolkitError(ierr)
-    spe_out = [type_ind.value,units.value,aTol.value,rTol.value]
+    spe_out = [_int1.value,_unitsbuf.value,_dbl1.value,_dbl2.value]
     return spe_out
 
 def MSXgeterror(errcode,len=100):
@@ -357,7 +687,7 @@ def MSXgeterror(errcode,len=100):
     msg is a C-style string containing text of error message corresponding to error code
     len is the max number of charaters that msg can contain (at least 80)"""
     errmsg= ctypes.create_string_buffer(len)
-    _lib.MSXgeterror(errcode,ctypes.byref(errmsg),len)
+    _MSXgeterror(errcode,errmsg,len)
     return errmsg.value.decode()
 
 #--------------set parameters-----------------------------------
@@ -367,7 +697,7 @@ def MSXsetconstant(ind,value):
     Arguments:
     ind is the sequence number of the reaction constant (starting from 1) as it appreaed in the MSX input file
     value is the new value to be assigned to the constant"""
-    ierr= _lib.MSXsetconstant(ctypes.c_int(ind),ctypes.c_double(value))
+    ierr= _MSXsetconstant(_index(ind),_c_double(value))
     if ierr!=0: raise MSXtoolkitError(ierr)
 
 def MSXsetparameter(type,ind,param,value):
@@ -376,13 +706,9 @@ def MSXsetparameter(type,ind,param,value):
     type is the type of object: MSX_NODE (0) or MSX_LINK (1)
     ind is the internal sequence number(starting from 1) assigned to the node or link
     param is the sequence number of the parameter (starting from 1 as listed in the MSX input file"""
-    type_ind = 100
-    if type == 'MSX_NODE' or type == 0:
-        type_ind = 0
-    if type == 'MSX_LINK' or type == 1:
-        type_ind = 1
-    if type_ind == 100: raise Exception('unrecognized type')
-    ierr= _lib.MSXsetparameter(ctypes.c_int(type_ind),ctypes.c_int(ind),ctypes.c_int(param),ctypes.c_double(value))
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    ierr= _MSXsetparameter(type_ind,_index(ind),_index(param),_c_double(value))
     if ierr!=0: raise MSXtoolkitError(ierr)
 
 def MSXsetinitqual(type,ind,spe,value):
@@ -392,15 +718,55 @@ def MSXsetinitqual(type,ind,spe,value):
     type is type of object: MSX_NODE (0), MSX_LINK (1)
     ind is the internal sequence number (starting from 1) assigned to the node or link
     speicies is the sequence number of teh species (starting  from 1)"""
-    type_ind = 100
-    if type == 'MSX_NODE' or type == 0:
-        type_ind = 0
-    if type == 'MSX_LINK' or type == 1:
-        type_ind = 1
-    if type_ind == 100: raise Exception('unrecognized type')
-    ierr= _lib.MSXsetinitqual(ctypes.c_int(type_ind),ctypes.c_int(ind),ctypes.c_int(spe),ctypes.c_double(value))
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    ierr= _MSXsetinitqual(type_ind,_index(ind),_index(spe),_c_double(value))
     if ierr!=0: raise MSXtoolkitError(ierr)
 
+def MSXsetparameterarray(type,param,values):
+    """assigns a value of a reaction parameter to every node (TANK) or every link (PIPE) at once
+    Arguments:
+    type is the type of object: MSX_NODE (0) or MSX_LINK (1)
+    param is the sequence number of the parameter (starting from 1 as listed in the MSX input file)
+    values is an array with one value per node or link: values[i] goes to node or link i+1"""
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    values = _locationvalues(type_ind,values,())
+    _setarray(_MSXsetparameter,type_ind,(_index(param),),values)
+
+def MSXsetinitqualarray(type,spe,values):
+    """assigns the initial concentration of one or all species at every node or every link at once
+    Arguments:
+    type is type of object: MSX_NODE (0), MSX_LINK (1)
+    spe is the sequence number of the species (starting from 1), or None for all species
+    values is an array of shape (number of nodes or links,) for a single species, or
+    (number of nodes or links, number of species) for all species; row i goes to node or link i+1"""
+    type_ind = _LOCATION_TYPES.get(type)
+    if type_ind is None: raise Exception('unrecognized type')
+    if spe is None:
+        values = _locationvalues(type_ind,values,(MSXgetcount(3),))
+        _setarray(_MSXsetinitqual,type_ind,range(1,values.shape[1]+1),values)
+    else:
+        values = _locationvalues(type_ind,values,())
+        _setarray(_MSXsetinitqual,type_ind,(_index(spe),),values)
+
+def _locationvalues(type_ind,values,trailing):
+    """Checks that values has one row per node or link (and the trailing shape) and returns it as float64"""
+    values = np.asarray(values,dtype=np.float64)
+    shape = (MSXgetcount(type_ind),)+trailing
+    if values.shape != shape:
+        raise ValueError('values must have shape '+str(shape)+', not '+str(values.shape))
+    return values
+
+def _setarray(setter,type_ind,items,values):
+    """Calls setter(type, location, item, value) for every location and item; values is (locations,) or (locations, items)"""
+    double = _c_double
+    for k,item in enumerate(items):
+        column = values[:,k] if values.ndim == 2 else values
+        for i,value in enumerate(column.tolist(),1):
+            ierr = setter(type_ind,i,item,double(value))
+            if ierr!=0: raise MSXtoolkitError(ierr)
+
 def MSXsetsource(node,spe,type_n,level,pat):
     """sets the attributes of an external source of a particular chemical species in a specific node of the pipe network
     Arguments:
@@ -411,19 +777,9 @@ def MSXsetsource(node,spe,type_n,level,pat):
     MSX_SETPOINT (2) setpoint source; MSX_FLOWPACED (3) flow paced source
     level is the baseline concentration (or mass flow rate) of the source
     pat is the index of the time pattern used to add variability to the source's baseline level (0 if no pattern defined for the source)"""
-    type_ind = 100
-    if type_n == 'MSX_NOSOURCE' or type_n == -1:
-        type_ind = -1
-    if type_n == 'MSX_CONCEN' or type_n == 0:
-        type_ind = 0
-    if type_n == 'MSX_MASS' or type_n == 1:
-        type_ind = 1
-    if type_n == 'MSX_SETPOINT' or type_n == 2:
-        type_ind = 2
-    if type_n == 'MSX_FLOWPACED' or type_n == 3:
-        type_ind = 3
-    if type_ind == 100: raise Exception('unrecognized type')
-    ierr= _lib.MSXsetsource(ctypes.c_int(node),ctypes.c_int(spe),ctypes.c_int(type_ind),ctypes.c_double(level),ctypes.c_int(pat))
+    type_ind = _SOURCE_TYPES.get(type_n)
+    if type_ind is None: raise Exception('unrecognized type')
+    ierr= _MSXsetsource(_index(node),_index(spe),type_ind,_c_double(level),_index(pat))
     if ierr!=0: raise MSXtoolkitError(ierr)
 
 def MSXsetpattern(pat,mult):
@@ -431,13 +787,11 @@ def MSXsetpattern(pat,mult):
     Arguments:
     pat is the internal sequence number (starting from 1) of the pattern as appears in the MSX input file
     mult is an array of multiplier values to replace those preciously used by the pattern
+    (any sequence; a contiguous float64 NumPy array is handed to the library without copying)
     len is the number of entries in mult"""
-    length = len(mult)
-    cfactors_type= ctypes.c_double*length
-    cfactors = cfactors_type()
-    for i in range(length):
-       cfactors[i]= float(mult[i])
-    ierr= _lib.MSXsetpattern(ctypes.c_int(pat),cfactors,ctypes.c_int(length))
+    cfactors = np.ascontiguousarray(mult,dtype=np.float64)
+    if cfactors.ndim != 1: raise ValueError('mult must be one-dimensional')
+    ierr= _MSXsetpattern(_index(pat),cfactors.ctypes.data_as(_c_double_p),len(cfactors))
     if ierr!=0: raise MSXtoolkitError(ierr)
 
 def MSXsetpatternvalue(pat,period,value):
@@ -446,22 +800,1151 @@ def MSXsetpatternvalue(pat,period,value):
        index: time pattern index
        period: period within time pattern
        value:  multiplier factor for the period"""
-    ierr= _lib.MSXsetpatternvalue(ctypes.c_int(pat),ctypes.c_int(period),ctypes.c_double(value))
+    ierr= _MSXsetpatternvalue(_index(pat),_index(period),_c_double(value))
     if ierr!=0: raise MSXtoolkitError(ierr)
 
+def MSXsetsourcearray(sources,previous=None):
+    """assigns the external sources of every species at every node in one pass
+    Arguments:
+    sources is a structured array of shape (number of nodes, number of species) with the fields of MSX_SOURCE_DTYPE,
+    as returned by MSXgetsourcearray
+    previous is an optional array of the same layout holding the sources currently set (e.g. the configuration
+    applied last): only the entries that differ from it are passed to the library"""
+    shape = (MSXgetcount(0),MSXgetcount(3))
+    sources = np.asarray(sources)
+    if sources.shape != shape or sources.dtype.names is None or not set(MSX_SOURCE_DTYPE.names) <= set(sources.dtype.names):
+        raise ValueError('sources must be a structured array of shape '+str(shape)+' with fields type, level, pattern')
+    types = sources['type']
+    if not np.isin(types,list(_SOURCE_TYPES.values())).all(): raise Exception('unrecognized type')
+    if previous is None:
+        nodes,species = np.indices(shape).reshape(2,-1)
+    else:
+        changed = ((types != previous['type']) | (sources['level'] != previous['level']) |
+                   (sources['pattern'] != previous['pattern']))
+        nodes,species = np.nonzero(changed)
+    setsource = _MSXsetsource
+    double = _c_double
+    for i,s,type_ind,level,pat in zip((nodes+1).tolist(),(species+1).tolist(),types[nodes,species].tolist(),
+                                      sources['level'][nodes,species].tolist(),sources['pattern'][nodes,species].tolist()):
+        ierr = setsource(i,s,type_ind,double(level),pat)
+        if ierr!=0: raise MSXtoolkitError(ierr)
+
+def MSXsetpatterns(patterns,previous=None):
+    """assigns new multipliers to several SOURCE time patterns in one pass
+    Arguments:
+    patterns is a dict {pattern index: multipliers}, as returned by MSXgetpatterns
+    previous is an optional dict of the multipliers currently set: patterns equal to it are skipped"""
+    for pat,mult in patterns.items():
+        if previous is not None and pat in previous and np.array_equal(previous[pat],mult): continue
+        MSXsetpattern(pat,mult)
+
 def MSXaddpattern(patternid):
     """Adds a new, empty MSX source time pattern to an MSX project.
     Arguments:
       pattern id: c-string name of pattern"""
-    ierr=_lib.MSXaddpattern(ctypes.c_char_p(patternid.encode()))
+    ierr=_MSXaddpattern(patternid.encode())
+    _names.pop(7,None)
     if ierr!=0: raise MSXtoolkitError(ierr)
 
+#--------------reading results-----------------------------------
+
+_MSX_MAGICNUMBER = 516114521
+_MSX_MAXUNITS = 16
+
+class MSXoutfile(object):
+    """Read-only, memory-mapped view of a binary results file written by MSXsaveoutfile
+    Opening the file only reads its prolog and epilog; the results are exposed as NumPy views over the
+    mapped file, so slicing a single node's time series only touches the pages holding it.
+    Arguments:
+    fname: name of the binary MSX results file
+    Attributes:
+    nodes, links, species: number of nodes, links and species in the file
+    periods: number of reporting periods; rstep: reporting time step in seconds
+    speciesID, units: IDs and mass units of the species (from the prolog) as str
+    errcode: error code stored in the epilog
+    nodequal, linkqual: read-only float32 views of shape (periods, nodes or links, species);
+    node/link i and species j are at [:, i-1, j-1]
+    The file also supports out[period, location_type, index, species] with zero-based NumPy indices."""
+
+    def __init__(self, fname):
+        with open(fname,'rb') as f:
+            self._mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            self._read(fname)
+        except:
+            self._mm.close()
+            raise
+
+    def _read(self, fname):
+        mm = self._mm
+        if len(mm) < 40: raise ValueError(fname+' is not an MSX binary results file')
+        magic,version,self.nodes,self.links,self.species,self.rstep = struct.unpack_from('<6i',mm,0)
+        offset,self.periods,self.errcode,endmagic = struct.unpack_from('<4i',mm,len(mm)-16)
+        if magic != _MSX_MAGICNUMBER or endmagic != _MSX_MAGICNUMBER:
+            raise ValueError(fname+' is not an MSX binary results file')
+        self.version = version
+        pos = 24
+        self.speciesID = []
+        for j in range(self.species):
+            n, = struct.unpack_from('<i',mm,pos)
+            self.speciesID.append(mm[pos+4:pos+4+n].decode())
+            pos += 4+n
+        self.units = []
+        for j in range(self.species):
+            self.units.append(mm[pos:pos+_MSX_MAXUNITS].split(b'\0')[0].decode())
+            pos += _MSX_MAXUNITS
+        nodebytes = 4*self.nodes*self.species
+        periodbytes = nodebytes+4*self.links*self.species
+        if offset + periodbytes*self.periods > len(mm)-16:
+            raise ValueError(fname+' is truncated')
+        # within a period values are stored species by species, nodes first then links
+        self.nodequal = np.ndarray((self.periods,self.nodes,self.species),dtype='<f4',buffer=mm,offset=offset,
+                                   strides=(periodbytes,4,4*self.nodes))
+        self.linkqual = np.ndarray((self.periods,self.links,self.species),dtype='<f4',buffer=mm,offset=offset+nodebytes,
+                                   strides=(periodbytes,4,4*self.links))
+
+    def _qualarray(self, type):
+        if type == 'MSX_NODE' or type == 0:
+            return self.nodequal
+        if type == 'MSX_LINK' or type == 1:
+            return self.linkqual
+        raise Exception('unrecognized type')
+
+    def __getitem__(self, key):
+        if not isinstance(key,tuple) or len(key) < 2:
+            raise IndexError('index as [period, location_type, index, species]')
+        return self._qualarray(key[1])[(key[0],)+key[2:]]
+
+    def series(self, type, ind, spe):
+        """Returns the time series (one value per reporting period) of species spe at node or link ind
+        Arguments:
+        type is type of object: MSX_NODE (0), MSX_LINK (1)
+        ind is the internal sequence number (starting from 1) assigned to the node or link
+        spe is the sequence number of the species (starting from 1)"""
+        return self._qualarray(type)[:,ind-1,spe-1]
+
+    def times(self):
+        """Returns the time in seconds of every reporting period"""
+        return np.arange(self.periods)*self.rstep
+
+    def close(self):
+        """Releases the file mapping; views still in use keep it alive until they are dropped"""
+        self.nodequal = self.linkqual = None
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#--------------report parser-----------------------------------
+
+MSXreporttable = collections.namedtuple('MSXreporttable','ids species units times values')
+MSXreporttable.__doc__ = """Node or link tables of an MSXreport text report
+ids: object IDs (str), in report order; species, units: reported species IDs and units
+times: reporting times in seconds; values: float64 array of shape (objects, times, species), NaN where a table is shorter"""
+
+_REPORT_HEADER = re.compile(rb'<<< (Node|Link) (\S+) >>>')
+# table rows, and every line that is not one (page headers, column headers, blank lines)
+_REPORT_DATA = re.compile(rb'(?m)^[ \t]*\d+:\d\d[ \t]')
+_REPORT_NONDATA = re.compile(rb'(?m)^(?![ \t]*\d+:\d\d[ \t]).*$')
+
+def MSXreadreport(fname,nodes=None,links=None,blocksize=1<<24):
+    """Parses the node and link tables of a text report written by MSXreport into arrays
+    The file is streamed in large blocks. Table rows have the fixed layout MSXreport writes
+    ("%4d:%02d" then "  %10.*f" per species), so each block is decoded column by column with NumPy,
+    without building Python objects per line; tables with rows that do not fit that layout (e.g. hours past 9999) are parsed
+    as free-format text instead. The species columns are read separately for node and link tables
+    (node tables leave out wall species), and a table continued after a page break under a repeated
+    header is joined to its first part. Returns a dict {'node': MSXreporttable, 'link': MSXreporttable}.
+    Arguments:
+    nodes, links: IDs of the nodes and links whose tables are read; None reads all, an empty list none
+    blocksize: number of bytes read at a time"""
+    wanted = {b'Node':None if nodes is None else {id.encode() for id in nodes},
+              b'Link':None if links is None else {id.encode() for id in links}}
+    sections = {b'Node':([],[]),b'Link':([],[])}
+    columns = {}
+    previous = None
+    buf = b''
+    with open(fname,'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            buf += block
+            headers = list(_REPORT_HEADER.finditer(buf))
+            # the last section, or a header line cut in two, may continue in the next block
+            if not block: cut = len(buf)
+            elif headers: cut = headers[-1].start()
+            else: cut = buf.rfind(b'\n')+1
+            done = headers if not block else headers[:-1]
+            ends = [h.start() for h in done[1:]]+[cut]
+            for h,end in zip(done,ends):
+                if h.group(1) not in columns: columns[h.group(1)] = _reportcolumns(buf[h.end():end])
+            found = {}
+            for kind in (b'Node',b'Link'):
+                selected = [h.group(1) == kind and (wanted[kind] is None or h.group(2) in wanted[kind]) for h in done]
+                if not any(selected): continue
+                tables = _reporttables(buf,cut,done,selected,ends,len(columns[kind]['species']))
+                found.update((k,table) for k,table in enumerate(tables) if table is not None)
+            for k,h in enumerate(done):
+                key = (h.group(1),h.group(2).decode())
+                if k in found:
+                    ids,tables = sections[key[0]]
+                    if key == previous and ids and ids[-1] == key[1]:
+                        tables[-1] = np.concatenate((tables[-1],found[k]))
+                    else:
+                        ids.append(key[1])
+                        tables.append(found[k])
+                previous = key
+            if not block: break
+            buf = buf[cut:]
+    out = {}
+    for kind,key in ((b'Node','node'),(b'Link','link')):
+        if wanted[kind] is not None and not wanted[kind]: continue
+        ids,tables = sections[kind]
+        names = columns.get(kind,{'species':[],'units':[]})
+        ntimes = max([len(table) for table in tables] or [0])
+        values = np.full((len(tables),ntimes,len(names['species'])),np.nan)
+        times = np.empty(0,dtype=np.int64)
+        for k,table in enumerate(tables):
+            values[k,:len(table)] = table[:,2:]
+            if len(table) == ntimes and len(times) == 0:
+                times = (table[:,0]*3600+table[:,1]*60).astype(np.int64)
+        out[key] = MSXreporttable(ids,names['species'],names['units'],times,values)
+    return out
+
+def _reportcolumns(body):
+    """Reads the species IDs and units from the column headers of a report table"""
+    species = units = None
+    for line in body.split(b'\n',8)[:8]:
+        words = line.split()
+        if words[:1] == [b'Time'] and species is None: species = [w.decode() for w in words[1:]]
+        elif words[:1] == [b'hr:min'] and units is None: units = [w.decode() for w in words[1:]]
+    return {'species':species or [],'units':units or []}
+
+def _reporttables(buf,cut,headers,selected,ends,nspecies):
+    """Returns the (rows, 2+nspecies) table [hours, minutes, values...] of each selected section of buf[:cut]
+    ends holds the offset where each section ends"""
+    a = np.frombuffer(buf,dtype=np.uint8,count=cut)
+    lineends = np.flatnonzero(a == 10)
+    starts = np.concatenate(([0],lineends+1))
+    lineends = np.concatenate((lineends,[cut]))
+    lineends = lineends-((lineends > starts) & (a[np.maximum(lineends-1,0)] == 13))  # CRLF files
+    # data rows match _REPORT_DATA: the first ':' of the line follows blanks and digits and precedes two digits and a blank
+    colons = np.flatnonzero(a == 58)
+    line = np.searchsorted(starts,colons,side='right')-1
+    first = np.flatnonzero(np.diff(line,prepend=-1))
+    line,colons = line[first],colons[first]
+    starts,lineends = starts[line],lineends[line]
+    digit = lambda c: (c >= 48) & (c <= 57)
+    blank = lambda c: (c == 32) | (c == 9)
+    at = lambda p: a[np.clip(p,0,cut-1)]
+    row = ((colons > starts) & (colons+3 < lineends) & digit(at(colons-1)) & digit(at(colons+1)) & digit(at(colons+2))
+           & blank(at(colons+3)))
+    starts,lineends,colons = starts[row],lineends[row],colons[row]
+    hdrpos = np.array([h.start() for h in headers])
+    owner = np.searchsorted(hdrpos,starts,side='right')-1
+    keep = owner >= 0
+    keep[keep] = np.array(selected)[owner[keep]]
+    starts,lineends,colons,owner = starts[keep],lineends[keep],colons[keep],owner[keep]
+    width = colons-starts
+    ok = np.ones(len(starts),dtype=bool)
+    inblanks = np.zeros(len(starts),dtype=bool)
+    for k in range(2,int(width.max(initial=0))+1):
+        c = at(colons-k)
+        active = k <= width
+        ok &= ~active | blank(c) | (digit(c) & ~inblanks)
+        inblanks |= active & blank(c)
+    starts,lineends,colons,owner = starts[ok],lineends[ok],colons[ok],owner[ok]
+    rowlen = 9+12*nspecies
+    # sections with a row off the fixed layout (e.g. hours wider than %4d) are parsed field by field
+    free = np.zeros(len(headers),dtype=bool)
+    free[owner[(lineends-starts != rowlen) | (colons-starts != 6)]] = True
+    fixed = ~free[owner]
+    starts,owner = starts[fixed],owner[fixed]
+    chars = np.lib.stride_tricks.sliding_window_view(a,rowlen)[starts] if len(starts) else np.empty((0,rowlen),np.uint8)
+    table = _fixedfields(chars,[(2,4),(7,2)]+[(11+12*j,10) for j in range(nspecies)])
+    bounds = np.searchsorted(owner,np.arange(len(headers)+1))
+    return [None if not sel else _reporttable(buf[h.end():end],nspecies,h.group(0)) if free[k] else table[bounds[k]:bounds[k+1]]
+            for k,(h,sel,end) in enumerate(zip(headers,selected,ends))]
+
+def _fixedfields(c,fields):
+    """Decodes right-aligned %d or %f text fields from a (rows, width) character array
+    Returns a (rows, len(fields)) array; fields is a sequence of (start, width) column spans.
+    A value is the integer of all its digits divided by 10**(digits after the point), which is exact up to 15 digits."""
+    digits = c-np.uint8(48)
+    isdigit = digits <= 9
+    dot = c == 46
+    out = np.empty((len(c),len(fields)))
+    if len(c) == 0: return out
+    if (dot == dot[0]).all():
+        # every row has the same precision per field: one matrix product for all fields
+        weights = np.zeros((c.shape[1],len(fields)))
+        divisors = np.ones(len(fields))
+        for k,(start,width) in enumerate(fields):
+            span = np.arange(start,start+width)
+            point = np.flatnonzero(dot[0,start:start+width])
+            p = start+point[0] if len(point) else start+width
+            weights[span,k] = 10.0**(start+width-1-span-(span < p)*(p < start+width))
+            weights[p if p < start+width else span[:0],k] = 0
+            divisors[k] = 10.0**(start+width-1-p if p < start+width else 0)
+        np.matmul((digits*isdigit).astype(np.float64),weights,out=out)
+        out /= divisors
+    else:
+        rows = np.arange(len(c))
+        for k,(start,width) in enumerate(fields):
+            isd = isdigit[:,start:start+width]
+            right = np.cumsum(isd[:,::-1],axis=1)[:,::-1]-isd
+            mantissa = np.where(isd,digits[:,start:start+width].astype(np.int64)*10**right,0).sum(1)
+            first = dot[:,start:start+width].argmax(1)
+            decimals = np.where(dot[:,start:start+width].any(1),right[rows,first]+isd[rows,first],0)
+            out[:,k] = mantissa/10.0**decimals
+    for k,(start,width) in enumerate(fields):
+        negative = (c[:,start:start+width] == 45).any(1)
+        out[negative,k] *= -1
+    return out
+
+def _reporttable(body,nspecies,header):
+    """Free-format fallback of _reporttables for one section"""
+    rows = np.fromstring(_REPORT_NONDATA.sub(b'',body).replace(b':',b' '),sep=' ')
+    nrows = len(_REPORT_DATA.findall(body))
+    if rows.size != nrows*(2+nspecies):
+        raise ValueError('report table %s does not have %d species columns' % (header.decode(),nspecies))
+    return rows.reshape(nrows,2+nspecies)
+
+#--------------result recorder-----------------------------------
+
+class MSXrecorder(object):
+    """Records selected concentrations while stepping into a folder of compressed, columnar chunk files
+    Every chunk_NNNNNN.npz holds the columns of chunksize recorded steps: 'time' (seconds) and one
+    (rows, locations) array per location type and species, named 'node_<species index>' or 'link_<species index>'.
+    meta.json describes the selection and lists the chunks. Memory use is bounded by one chunk, and opening
+    an existing recording with the same selection appends to it.
+    Arguments:
+    folder: folder of the recording (created if needed)
+    nodes, links: sequences of node and link indices (starting from 1) to record; None records none
+    species: sequence of species indices (starting from 1) to record; None records all species
+    every: record every Nth step (ignored when interval is given)
+    interval: record only the steps reaching a multiple of interval seconds, e.g. the reporting step
+    chunksize: number of recorded steps per chunk file
+    dtype: storage type of the values (float32 by default)"""
+
+    def __init__(self, folder, nodes=None, links=None, species=None, every=1, interval=None, chunksize=1024, dtype='<f4'):
+        if species is None: species = range(1,MSXgetcount(3)+1)
+        self.folder = folder
+        self.every = every
+        self.interval = interval
+        self.chunksize = chunksize
+        self.dtype = np.dtype(dtype)
+        self.species = [_index(spe) for spe in species]
+        self.selection = {'node':[_index(i) for i in (() if nodes is None else nodes)],
+                          'link':[_index(i) for i in (() if links is None else links)]}
+        if not self.selection['node'] and not self.selection['link']:
+            raise ValueError('nothing to record: give nodes and/or links')
+        os.makedirs(folder,exist_ok=True)
+        self.meta = {'nodes':self.selection['node'],'links':self.selection['link'],'species':self.species,
+                     'speciesID':[MSXgetID(3,spe).decode() for spe in self.species],
+                     'dtype':self.dtype.str,'chunks':[]}
+        metafile = os.path.join(folder,'meta.json')
+        if os.path.exists(metafile):
+            with open(metafile) as f:
+                meta = json.load(f)
+            if any(meta[k] != self.meta[k] for k in ('nodes','links','species','dtype')):
+                raise ValueError(folder+' holds a recording of another selection')
+            self.meta['chunks'] = meta['chunks']
+        # stage each step in float64 through precomputed pointers, then copy into the chunk
+        self._stage = {}
+        self._chunk = {}
+        for type,ind in self.selection.items():
+            if not ind: continue
+            stage = np.empty((len(ind),len(self.species)))
+            self._stage[type] = (_LOCATION_TYPES['MSX_'+type.upper()],stage,_qualrefs(stage,ind,self.species))
+            self._chunk[type] = np.empty((chunksize,len(ind),len(self.species)),dtype=self.dtype)
+        self._times = np.empty(chunksize,dtype=np.int64)
+        self._rows = 0
+        self._steps = 0
+
+    def due(self, t):
+        """Tells whether the step reaching time t is to be recorded (counts the step)"""
+        self._steps += 1
+        if self.interval is not None:
+            return t % self.interval == 0
+        return self._steps % self.every == 0
+
+    def record(self, t, force=False):
+        """Call after every MSXstep with its time t; records the current concentrations if the step is due (or force)"""
+        if not force and not self.due(t): return False
+        row = self._rows
+        for type,(type_ind,stage,refs) in self._stage.items():
+            _getquals(type_ind,refs)
+            self._chunk[type][row] = stage
+        self._times[row] = t
+        self._rows += 1
+        if self._rows == self.chunksize: self.flush()
+        return True
+
+    def run(self, init=True, saveFlag=0):
+        """Steps the simulation to its end, recording as configured (the initial state at time 0 is recorded too when init)"""
+        if init:
+            MSXinit(saveFlag)
+            self.record(0,force=True)
+        while True:
+            t,tleft = MSXstep()
+            self.record(t)
+            if tleft <= 0: break
+
+    def flush(self):
+        """Writes the recorded rows not yet on disk as a new chunk file and updates meta.json"""
+        if self._rows > 0:
+            rows = self._rows
+            name = 'chunk_%06d.npz' % len(self.meta['chunks'])
+            columns = {'time':self._times[:rows]}
+            for type,chunk in self._chunk.items():
+                for k,spe in enumerate(self.species):
+                    columns[type+'_'+str(spe)] = np.ascontiguousarray(chunk[:rows,:,k])
+            np.savez_compressed(os.path.join(self.folder,name),**columns)
+            self.meta['chunks'].append({'file':name,'rows':rows,'t0':int(self._times[0]),'t1':int(self._times[rows-1])})
+            self._rows = 0
+        tmp = os.path.join(self.folder,'meta.json.tmp')
+        with open(tmp,'w') as f:
+            json.dump(self.meta,f,indent=1)
+        os.replace(tmp,os.path.join(self.folder,'meta.json'))
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def MSXreadrecording(folder,columns=None,t0=None,t1=None):
+    """Reads a recording made by MSXrecorder and returns a dict of concatenated columns
+    'time' plus 'node_<species index>' / 'link_<species index>' arrays of shape (rows, locations), and 'meta'.
+    Arguments:
+    columns: optional list of column names to read (time is always read)
+    t0, t1: optional time window in seconds; only the chunks overlapping it are opened"""
+    with open(os.path.join(folder,'meta.json')) as f:
+        meta = json.load(f)
+    parts = collections.defaultdict(list)
+    for chunk in meta['chunks']:
+        if (t0 is not None and chunk['t1'] < t0) or (t1 is not None and chunk['t0'] > t1): continue
+        with np.load(os.path.join(folder,chunk['file'])) as data:
+            time = data['time']
+            keep = np.ones(len(time),dtype=bool)
+            if t0 is not None: keep &= time >= t0
+            if t1 is not None: keep &= time <= t1
+            for name in data.files:
+                if columns is None or name == 'time' or name in columns:
+                    parts[name].append(data[name][keep])
+    out = {name:np.concatenate(arrays) for name,arrays in parts.items()}
+    out.setdefault('time',np.empty(0,dtype=np.int64))
+    out['meta'] = meta
+    return out
+
+#--------------hydraulics cache-----------------------------------
+
+def _hashfiles(files):
+    """Returns a sha256 object fed with the contents of the given files"""
+    h = hashlib.sha256()
+    for fname in files:
+        with open(fname,'rb') as f:
+            for block in iter(lambda: f.read(1<<20),b''):
+                h.update(block)
+        h.update(b'\0')
+    return h
+
+class MSXhydcache(object):
+    """Local disk cache of binary hydraulics files, keyed by a hash of the hydraulic inputs
+    Water-quality-only sweeps can then skip MSXsolveH: on a hit the cached file is handed to MSXusehydfile.
+    Files are evicted least recently used first once the cache exceeds maxbytes or maxfiles.
+    The cache can be shared by several processes; the access time of an entry is its file modification time.
+    Arguments:
+    directory: folder holding the cached files (created if needed)
+    maxbytes: max total size of the cached files, None for no limit
+    maxfiles: max number of cached files, None for no limit"""
+
+    def __init__(self, directory, maxbytes=None, maxfiles=None):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.maxfiles = maxfiles
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory,exist_ok=True)
+
+    @staticmethod
+    def key(*files, **extra):
+        """Returns the cache key of a network: a hash of the contents of the given files (e.g. the EPANET .inp file)
+        and of any extra keyword values that change the hydraulics"""
+        h = _hashfiles(files)
+        h.update(repr(sorted(extra.items())).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory,key+'.hyd')
+
+    def use(self, key, save):
+        """Makes the hydraulics of key the current binary hydraulics file (MSXusehydfile) and returns True on a cache hit
+        Arguments:
+        key: cache key, usually from MSXhydcache.key
+        save: callable save(fname) that solves the hydraulics and writes the binary hydraulics file to fname
+        (e.g. ENsolveH followed by ENsavehydfile of the EPANET toolkit); only called on a miss"""
+        fname = self.path(key)
+        hit = os.path.exists(fname)
+        if hit:
+            self.hits += 1
+            os.utime(fname)
+        else:
+            self.misses += 1
+            tmp = fname+'.'+str(os.getpid())+'.tmp'
+            try:
+                save(tmp)
+                os.replace(tmp,fname)
+            finally:
+                if os.path.exists(tmp): os.remove(tmp)
+            self.evict(keep=fname)
+        MSXusehydfile(fname)
+        return hit
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.hyd'):
+                fname = os.path.join(self.directory,name)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime,st.st_size,fname))
+        return entries
+
+    def evict(self, keep=None):
+        """Removes least recently used files until the size limits are met (the file keep is never removed)"""
+        entries = sorted(self._entries())
+        total = sum(size for mtime,size,fname in entries)
+        count = len(entries)
+        for mtime,size,fname in entries:
+            if (self.maxbytes is None or total <= self.maxbytes) and (self.maxfiles is None or count <= self.maxfiles):
+                break
+            if fname == keep: continue
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            self.evictions += 1
+            total -= size
+            count -= 1
+
+    def stats(self):
+        """Returns the hit/miss statistics of this cache object and the current size of the cache"""
+        entries = self._entries()
+        lookups = self.hits+self.misses
+        return {'hits':self.hits,'misses':self.misses,'evictions':self.evictions,
+                'hitrate':self.hits/lookups if lookups else 0.0,
+                'files':len(entries),'bytes':sum(size for mtime,size,fname in entries)}
+
+#--------------warm-start checkpoints-----------------------------------
+
+_STATE_MAGIC = b'MSXSTATE'
+_STATE_HEADER = struct.Struct('<8s32sqiii')
+
+def MSXsavestate(fname,msxfile,t):
+    """Saves the current concentrations of every species at every node and link to a binary snapshot file
+    The snapshot is keyed by a hash of the msx input file, so MSXloadstate rejects it once that file changes.
+    Typically called after stepping through a spin-up period, then restored with MSXloadstate as the
+    initial conditions of later runs.
+    Arguments:
+    fname: name of the snapshot file
+    msxfile: name of the msx input file the project was opened with
+    t: simulation time in seconds of the snapshot (as returned by MSXstep), stored for reference"""
+    nodes = MSXgetqualarray(0)
+    links = MSXgetqualarray(1)
+    digest = _hashfiles((msxfile,)).digest()
+    with open(fname,'wb') as f:
+        f.write(_STATE_HEADER.pack(_STATE_MAGIC,digest,t,nodes.shape[0],links.shape[0],nodes.shape[1]))
+        f.write(nodes.astype('<f8').tobytes())
+        f.write(links.astype('<f8').tobytes())
+
+def MSXloadstate(fname,msxfile):
+    """Sets the concentrations saved by MSXsavestate as the initial quality of every node and link and returns the snapshot time
+    Only node and link (average) concentrations are restored: the toolkit API does not expose the
+    concentration profile along a pipe. Runs still start at time 0 of the hydraulics in use.
+    Arguments:
+    fname: name of the snapshot file
+    msxfile: name of the msx input file of the open project; a snapshot taken from another version
+    of the file, or from a network of another size, raises ValueError"""
+    with open(fname,'rb') as f:
+        header = f.read(_STATE_HEADER.size)
+        if len(header) < _STATE_HEADER.size: raise ValueError(fname+' is not an MSX state snapshot')
+        magic,digest,t,nnodes,nlinks,nspecies = _STATE_HEADER.unpack(header)
+        if magic != _STATE_MAGIC: raise ValueError(fname+' is not an MSX state snapshot')
+        if digest != _hashfiles((msxfile,)).digest():
+            raise ValueError(fname+' was not saved from this version of '+msxfile)
+        if (nnodes,nlinks,nspecies) != (MSXgetcount(0),MSXgetcount(1),MSXgetcount(3)):
+            raise ValueError(fname+' does not match the size of the open network')
+        values = np.fromfile(f,dtype='<f8',count=(nnodes+nlinks)*nspecies)
+    if len(values) != (nnodes+nlinks)*nspecies: raise ValueError(fname+' is truncated')
+    MSXsetinitqualarray(0,None,values[:nnodes*nspecies].reshape(nnodes,nspecies))
+    MSXsetinitqualarray(1,None,values[nnodes*nspecies:].reshape(nlinks,nspecies))
+    return t
+
+#--------------scenario ensembles-----------------------------------
+# A scenario is a dict of setter deltas applied on top of the project as opened:
+#   'constants':  {constant_index: value}
+#   'parameters': {(location_type, location_index, parameter_index): value}
+#   'initqual':   {(location_type, location_index, species_index): value}
+#   'sources':    {(node_index, species_index): (source_type, level, pattern_index)}
+#   'patterns':   {pattern_index: [multipliers]}
+
+class MSXscenarios(object):
+    """Applies scenarios to the open project in place, as minimal setter diffs from a baseline snapshot,
+    so that repeated runs need no MSXclose/MSXopen (no reparsing, no file I/O)
+    The baseline values of the constants, parameters, initial qualities, sources and patterns are read with the
+    getters when the manager is created, right after MSXopen. apply(scenario) then calls the setters only where the
+    library has to change: values the previous scenario changed and this one does not are restored, values equal
+    to the baseline or already set are skipped.
+    Usage:
+    scenarios = msx.MSXscenarios()
+    for scenario in ...: scenarios.apply(scenario); run the simulation
+    scenarios.revert()"""
+    def __init__(self):
+        nspecies = MSXgetcount(3)
+        nparams = MSXgetcount(5)
+        self.constants = np.array([MSXgetconstant(i) for i in range(1,MSXgetcount(6)+1)])
+        self.parameters = {}
+        self.initqual = {}
+        for type_ind in (0,1):
+            n = MSXgetcount(type_ind)
+            self.parameters[type_ind] = np.array([[MSXgetparameter(type_ind,i,p) for p in range(1,nparams+1)]
+                                                  for i in range(1,n+1)]).reshape(n,nparams)
+            self.initqual[type_ind] = np.array([[MSXgetinitqual(type_ind,i,s) for s in range(1,nspecies+1)]
+                                                for i in range(1,n+1)]).reshape(n,nspecies)
+        self.sources = MSXgetsourcearray()
+        self.patterns = MSXgetpatterns()
+        # (kind, key) -> value for every entry that currently differs from the baseline
+        self.applied = {}
+
+    def apply(self,scenario):
+        """Brings the project to the baseline plus the setter deltas of scenario (see the format above)
+        If a setter fails, the project is reverted to the baseline and the error raised."""
+        target = {}
+        for kind in ('constants','parameters','initqual','sources','patterns'):
+            for key,value in scenario.get(kind,{}).items():
+                key,value = self._normalize(kind,key,value)
+                if value != self.baseline(kind,key): target[(kind,key)] = value
+        try:
+            for item in [item for item in self.applied if item not in target]:
+                self._set(item[0],item[1],self.baseline(*item))
+                del self.applied[item]
+            for item,value in target.items():
+                if self.applied.get(item) != value:
+                    self._set(item[0],item[1],value)
+                    self.applied[item] = value
+        except:
+            self.revert()
+            raise
+
+    def revert(self):
+        """Restores the baseline values of everything the applied scenario changed"""
+        for item in list(self.applied):
+            self._set(item[0],item[1],self.baseline(*item))
+            del self.applied[item]
+
+    def baseline(self,kind,key):
+        """Returns the baseline value of an entry, or None if its index is out of range"""
+        try:
+            if kind == 'constants':
+                return float(self.constants[_baserow(key)])
+            if kind == 'parameters' or kind == 'initqual':
+                type_ind,ind,item = key
+                return float(getattr(self,kind)[type_ind][_baserow(ind),_baserow(item)])
+            if kind == 'sources':
+                type_ind,level,pat = self.sources[_baserow(key[0]),_baserow(key[1])].tolist()
+                return (type_ind,level,pat)
+            return tuple(self.patterns[key].tolist())
+        except (IndexError,KeyError):
+            return None
+
+    def _normalize(self,kind,key,value):
+        if kind == 'constants':
+            return _index(key),float(value)
+        if kind == 'parameters' or kind == 'initqual':
+            type,ind,item = key
+            type_ind = _LOCATION_TYPES.get(type)
+            if type_ind is None: raise Exception('unrecognized type')
+            return (type_ind,_index(ind),_index(item)),float(value)
+        if kind == 'sources':
+            type_ind = _SOURCE_TYPES.get(value[0])
+            if type_ind is None: raise Exception('unrecognized type')
+            return (_index(key[0]),_index(key[1])),(type_ind,float(value[1]),_index(value[2]))
+        return _index(key),tuple(np.asarray(value,dtype=np.float64).reshape(-1).tolist())
+
+    def _set(self,kind,key,value):
+        if kind == 'constants': MSXsetconstant(key,value)
+        elif kind == 'parameters': MSXsetparameter(*(key+(value,)))
+        elif kind == 'initqual': MSXsetinitqual(*(key+(value,)))
+        elif kind == 'sources': MSXsetsource(*(key+value))
+        else: MSXsetpattern(key,value)
+
+def _baserow(ind):
+    """Row of a 1-based index in the baseline arrays"""
+    if ind < 1: raise IndexError(ind)
+    return ind-1
+
+MSXensembleresult = collections.namedtuple('MSXensembleresult','index times values error message')
+MSXensembleresult.__doc__ = """Result of one ensemble scenario, in the order the scenarios were given
+index: position of the scenario; times: step times in seconds
+values: concentrations per step laid out as in MSXgetqualarray, or whatever reduce returned
+error: MSX error code if the scenario failed (message holds its text), otherwise None"""
+
+_ensemble_error = None
+_ensemble_scenarios = None
+
+def _ensemble_init(msxfile,setup):
+    """Worker initializer: opens the project, solves the hydraulics and snapshots the baseline once per worker process"""
+    global _ensemble_error,_ensemble_scenarios
+    try:
+        if setup is not None: setup()
+        MSXopen(msxfile)
+        MSXsolveH()
+        _ensemble_scenarios = MSXscenarios()
+    except Exception as e:
+        # reported by every scenario of this worker; raising would break the pool over and over
+        _ensemble_error = e
+
+def _ensemble_run(index,scenario,type,spe,ind,reduce):
+    if isinstance(_ensemble_error,MSXtoolkitError):
+        return MSXensembleresult(index,None,None,_ensemble_error.args[0],_ensemble_error.message)
+    if _ensemble_error is not None:
+        return MSXensembleresult(index,None,None,None,repr(_ensemble_error))
+    try:
+        # the next scenario only undoes what it does not set itself
+        _ensemble_scenarios.apply(scenario)
+        times = []
+        values = []
+        for t,quals in MSXsteps(type,spe,ind):
+            times.append(t)
+            values.append(quals.copy())
+    except MSXtoolkitError as e:
+        return MSXensembleresult(index,None,None,e.args[0],e.message)
+    times = np.array(times)
+    values = np.array(values)
+    if reduce is not None:
+        return MSXensembleresult(index,times,reduce(times,values),None,None)
+    # hand the array back through shared memory instead of pickling it; the parent unlinks it
+    shm = shared_memory.SharedMemory(create=True,size=max(values.nbytes,1))
+    np.ndarray(values.shape,values.dtype,buffer=shm.buf)[...] = values
+    resource_tracker.unregister(shm._name,'shared_memory')
+    shm.close()
+    return MSXensembleresult(index,times,(shm.name,values.shape,values.dtype.str),None,None)
+
+def _ensemble_collect(result):
+    if result.error is not None or not isinstance(result.values,tuple):
+        return result
+    name,shape,dtype = result.values
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = np.ndarray(shape,dtype,buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return result._replace(values=values)
+
+def MSXensemble(msxfile,scenarios,type='MSX_NODE',spe=None,ind=None,processes=None,maxinflight=None,setup=None,reduce=None):
+    """Generator that runs scenarios over a pool of worker processes and yields an MSXensembleresult for each, in scenario order
+    Every worker opens msxfile and solves the hydraulics once, then for each scenario applies its setter deltas
+    with MSXscenarios and steps the simulation to the end recording the selected concentrations.
+    A failing scenario (or a worker that could not open the project) only fails its own result, with the MSX error code;
+    if a worker process dies, the pool is restarted and the scenarios that were in flight are rerun one at a time,
+    so that only a scenario that kills a worker on its own fails.
+    Arguments:
+    msxfile: name of the msx input file
+    scenarios: iterable of scenario dicts (format above); consumed lazily
+    type, spe, ind: what to record each step, as in MSXgetqualarray
+    processes: number of worker processes (default: number of CPUs)
+    maxinflight: max number of scenarios submitted but not yet yielded (default: twice the number of processes)
+    setup: optional picklable callable run in each worker before MSXopen, e.g. to open the EPANET network
+    reduce: optional picklable callable reduce(times, values) run in the worker; its return value replaces values"""
+    if processes is None: processes = os.cpu_count() or 1
+    if maxinflight is None: maxinflight = 2*processes
+    scenarios = iter(enumerate(scenarios))
+    # [index, scenario, future (None until submitted), rerun on its own]
+    pending = collections.deque()
+    pool = None
+    def submit(index,scenario):
+        try:
+            return pool.submit(_ensemble_run,index,scenario,type,spe,ind,reduce)
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # the pool broke since the last result: fail like the scenarios in flight, so it is rerun with them
+            future = concurrent.futures.Future()
+            future.set_exception(e)
+            return future
+    try:
+        while True:
+            if any(entry[3] for entry in pending):
+                # suspects of a broken pool are submitted one by one, once at the head with nothing else running
+                if pending[0][2] is None:
+                    if pool is None: pool = _ensemble_pool(processes,msxfile,setup)
+                    pending[0][2] = submit(pending[0][0],pending[0][1])
+            else:
+                while len(pending) < maxinflight:
+                    item = next(scenarios,None)
+                    if item is None: break
+                    index,scenario = item
+                    if pool is None: pool = _ensemble_pool(processes,msxfile,setup)
+                    pending.append([index,scenario,submit(index,scenario),False])
+            if not pending: break
+            index,scenario,future,alone = pending[0]
+            try:
+                result = _ensemble_collect(future.result())
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # a worker died (e.g. the library crashed) and took every unfinished scenario with it
+                pool.shutdown(wait=False)
+                pool = None
+                if not alone:
+                    for entry in pending:
+                        if not _ensemble_finished(entry[2]):
+                            entry[2] = None
+                            entry[3] = True
+                    continue
+                result = MSXensembleresult(index,None,None,None,repr(e))
+            except Exception as e:
+                result = MSXensembleresult(index,None,None,None,repr(e))
+            pending.popleft()
+            yield result
+    finally:
+        if pool is not None:
+            for entry in pending:
+                if entry[2] is not None: entry[2].cancel()
+            pool.shutdown()
+        # results computed but never yielded still hold a shared memory segment
+        for entry in pending:
+            if entry[2] is not None and _ensemble_finished(entry[2]):
+                _ensemble_collect(entry[2].result())
+
+def _ensemble_pool(processes,msxfile,setup):
+    return concurrent.futures.ProcessPoolExecutor(processes,initializer=_ensemble_init,initargs=(msxfile,setup))
+
+def _ensemble_finished(future):
+    """True if future holds a result (as opposed to running, cancelled or failed)"""
+    return future.done() and not future.cancelled() and future.exception() is None
+
+#--------------asyncio facade-----------------------------------
+
+class MSXasync(object):
+    """asyncio front end that runs every toolkit call on one dedicated worker thread
+    The library holds global state, so calls are serialized on that thread in the order they are made, and the
+    event loop stays free while a step or a solve runs. Once a facade is in use, make all toolkit calls through it.
+    Reads (get) of the same function and arguments are coalesced until the next step or write: concurrent
+    requests share a single library call and later ones get the same result (do not modify returned arrays);
+    reads with unhashable arguments always make their own call.
+    Functions can be given as toolkit functions or by name, e.g. sim.get('MSXgetqual',0,1,1)."""
+
+    def __init__(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(1,thread_name_prefix='MSX')
+        self._reads = {}
+        self.t = 0
+        self.tleft = None
+
+    def _submit(self, func, args):
+        if isinstance(func,str): func = globals()[func]
+        return asyncio.get_running_loop().run_in_executor(self._executor,functools.partial(func,*args))
+
+    async def get(self, func, *args):
+        """Awaits func(*args) as a read; identical reads share one call until the next step or write
+        (reads with unhashable arguments, e.g. lists or arrays of indices, are not coalesced)"""
+        key = (func,args)
+        try:
+            hash(key)
+        except TypeError:
+            return await asyncio.shield(self._submit(func,args))
+        fut = self._reads.get(key)
+        if fut is None or (fut.done() and (fut.cancelled() or fut.exception() is not None)):
+            fut = self._reads[key] = self._submit(func,args)
+        # shield: cancelling one waiter must not cancel the call the others wait for
+        return await asyncio.shield(fut)
+
+    async def set(self, func, *args):
+        """Awaits func(*args) as a write (any call that changes the project or the simulation)"""
+        self._reads.clear()
+        return await asyncio.shield(self._submit(func,args))
+
+    call = set
+
+    def _step(self):
+        self.t,self.tleft = MSXstep()
+        return [self.t,self.tleft]
+
+    async def step(self):
+        """Awaits one water quality time step (MSXstep) and returns [t, tleft]"""
+        self._reads.clear()
+        return await asyncio.shield(self._submit(self._step,()))
+
+    async def run(self, until=None, init=True, saveFlag=0):
+        """Steps the simulation until its end, or until the time reaches until (seconds), and returns [t, tleft]
+        The task can be cancelled at any time: the step in progress completes and no further step starts.
+        Arguments:
+        until: optional simulation time to stop at
+        init: set to False to continue a simulation already initialized
+        saveFlag is passed on to MSXinit"""
+        if init:
+            await self.set(MSXinit,saveFlag)
+        while True:
+            t,tleft = await self.step()
+            if tleft <= 0 or (until is not None and t >= until):
+                return [t,tleft]
+
+    def close(self, wait=True):
+        """Stops the worker thread once the calls already submitted are done"""
+        self._executor.shutdown(wait)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None,self.close)
+
+#--------------independent projects-----------------------------------
+
+_project_ids = itertools.count(1)
+
+def _libraryfile():
+    """Returns the path of the library file loaded by this module"""
+    if _lib is None: raise Exception('no EPANET-MSX library loaded: give the library file')
+    name = _lib._name
+    if os.path.isfile(name): return os.path.abspath(name)
+    if not os.path.splitext(name)[1]: name += '.dll'
+    for folder in [os.path.dirname(os.path.abspath(__file__))]+os.environ.get('PATH','').split(os.pathsep):
+        if os.path.isfile(os.path.join(folder,name)): return os.path.join(folder,name)
+    raise Exception('cannot locate '+name+': give the library file')
+
+class MSXproject(object):
+    """An MSX project with its own private copy of the toolkit library, independent of the module-level one
+    The library keeps one project in global state, so each MSXproject loads a copy of the library file under a
+    unique name and runs a private copy of this module bound to it. The whole module API is available as
+    attributes (project.MSXopen(...), project.MSXgetqualarray(...), project.MSXsteps(...), ...) and errors
+    are raised as MSXtoolkitError. ctypes releases the GIL during library calls, so projects can run in parallel
+    threads (one thread per project at a time).
+    Note: the EPANET library the MSX library links against is still loaded once per process and shared.
+    Arguments:
+    library: path of the EPANET-MSX shared library; by default the file loaded by this module"""
+
+    def __init__(self, library=None):
+        if library is None: library = _libraryfile()
+        n = next(_project_ids)
+        self._dir = tempfile.mkdtemp(prefix='msxproject')
+        # removes the folder of the library copy on close(), or when a project that was never closed is collected
+        self._cleanup = weakref.finalize(self,shutil.rmtree,self._dir,ignore_errors=True)
+        try:
+            base,ext = os.path.splitext(os.path.basename(library))
+            copy = os.path.join(self._dir,base+'_'+str(os.getpid())+'_'+str(n)+ext)
+            shutil.copyfile(library,copy)
+            loader = ctypes.WinDLL if _lib is not None and _plat == 'Windows' and isinstance(_lib,ctypes.WinDLL) else ctypes.CDLL
+            lib = loader(copy)
+            spec = importlib.util.spec_from_file_location(__name__+'_project'+str(n),__file__)
+            module = importlib.util.module_from_spec(spec)
+            module._lib = lib
+            spec.loader.exec_module(module)
+        except:
+            self._cleanup()
+            raise
+        geterror = module.MSXgeterror
+        class ProjectError(MSXtoolkitError):
+            def __init__(self, ierr, message=None):
+                MSXtoolkitError.__init__(self,ierr,geterror(ierr) if message is None else message)
+        ProjectError.__name__ = ProjectError.__qualname__ = 'MSXtoolkitError'
+        module.MSXtoolkitError = ProjectError
+        self.module = module
+        self.library = copy
+
+    def __getattr__(self, name):
+        if name.startswith('MSX') and 'module' in self.__dict__:
+            return getattr(self.module,name)
+        raise AttributeError(name)
+
+    def __dir__(self):
+        return sorted(set(object.__dir__(self))|{name for name in vars(self.module) if name.startswith('MSX')})
+
+    def close(self):
+        """Closes the project if it is open, unloads its library copy and removes the copied file"""
+        module = self.__dict__.pop('module',None)
+        if module is None: return
+        try:
+            module.MSXclose()
+        except MSXtoolkitError:
+            pass
+        handle = module._lib._handle
+        # functions and generators taken from the project before close() look these up on every call:
+        # make them raise instead of jumping into the unloaded library
+        error = module.MSXtoolkitError
+        def closed(*args):
+            raise error(519,'MSXproject closed: its library has been unloaded')
+        for name in _SIGNATURES:
+            setattr(module,'_'+name,closed)
+        module._lib = None
+        try:
+            import _ctypes
+            if _plat == 'Windows':
+                _ctypes.FreeLibrary(handle)
+            else:
+                _ctypes.dlclose(handle)
+        except (ImportError,AttributeError,OSError):
+            pass
+        self._cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#--------------profiling-----------------------------------
+# toolkit entry points instrumented by MSXprofile
+_PROFILED = ('MSXopen','MSXclose','MSXusehydfile','MSXsolveH','MSXinit','MSXsolveQ','MSXstep','MSXsteps','MSXdetect',
+             'MSXsaveoutfile','MSXsavemsxfile','MSXreport','MSXgetindex','MSXgetIDlen','MSXgetID','MSXgetIDs',
+             'MSXgetinitqual','MSXgetqual','MSXgetqualarray','MSXgetconstant','MSXgetparameter','MSXgetsource',
+             'MSXgetpatternlen','MSXgetpatternvalue','MSXgetcount','MSXgetspecies','MSXsetconstant',
+             'MSXsetparameter','MSXsetinitqual','MSXsetparameterarray','MSXsetinitqualarray','MSXsetsource',
+             'MSXsetpattern','MSXsetpatternvalue','MSXaddpattern','MSXgetsourcearray','MSXsetsourcearray',
+             'MSXgetpatterns','MSXsetpatterns')
+
+_profile_originals = {}
+_profile_stats = {}
+_profile_stepping = {'steps':0,'simulated':0.0,'wall':0.0,'t':0}
+_profile_samples = 10000
+
+class _ProfileStat(object):
+    __slots__ = ('calls','errors','total','samples')
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.samples = collections.deque(maxlen=_profile_samples)
+
+def _stepped(t,wall):
+    """Accounts a water quality step that reached time t in wall seconds"""
+    st = _profile_stepping
+    if t >= st['t']: st['simulated'] += t-st['t']
+    st['t'] = t
+    st['steps'] += 1
+    st['wall'] += wall
+
+def _profiled(name,func):
+    """Returns func wrapped so that every call is counted and timed in _profile_stats[name]"""
+    stat = _profile_stats.setdefault(name,_ProfileStat())
+    clock = time.perf_counter
+    if inspect.isgeneratorfunction(func):
+        # time every step of the generator, not its creation
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            gen = func(*args,**kwargs)
+            try:
+                while True:
+                    t0 = clock()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    except MSXtoolkitError:
+                        stat.errors += 1
+                        stat.calls += 1
+                        raise
+                    dt = clock()-t0
+                    stat.calls += 1
+                    stat.total += dt
+                    stat.samples.append(dt)
+                    _stepped(item[0],dt)
+                    yield item
+            finally:
+                gen.close()
+        return wrapper
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+        t0 = clock()
+        try:
+            out = func(*args,**kwargs)
+        except MSXtoolkitError:
+            stat.errors += 1
+            raise
+        finally:
+            dt = clock()-t0
+            stat.calls += 1
+            stat.total += dt
+            stat.samples.append(dt)
+        if name == 'MSXstep':
+            _stepped(out[0],dt)
+        elif name == 'MSXinit':
+            _profile_stepping['t'] = 0
+        return out
+    return wrapper
+
+def MSXprofile(enable=True,samples=10000):
+    """Turns call profiling of the toolkit functions on or off
+    While enabled, the module-level toolkit functions are replaced by wrappers that record call counts,
+    cumulative time, the latest latency samples and MSXtoolkitError counts, plus the simulated seconds
+    advanced per wall second by MSXstep/MSXsteps. Disabling restores the original functions, so profiling
+    costs nothing when off. Functions imported with 'from epanetmsxmodule import ...' before enabling are not profiled.
+    Arguments:
+    enable: True to profile, False to stop (statistics are kept until MSXprofilereset)
+    samples: number of most recent call latencies kept per function for the percentiles; a new value also
+    applies to the statistics already collected, which keep their latest samples"""
+    global _profile_samples
+    g = globals()
+    if enable and samples != _profile_samples:
+        _profile_samples = samples
+        for stat in _profile_stats.values():
+            stat.samples = collections.deque(stat.samples,maxlen=samples)
+    if enable and not _profile_originals:
+        for name in _PROFILED:
+            _profile_originals[name] = g[name]
+            g[name] = _profiled(name,g[name])
+    elif not enable and _profile_originals:
+        g.update(_profile_originals)
+        _profile_originals.clear()
+
+def MSXprofilereset():
+    """Clears the statistics collected by MSXprofile"""
+    for stat in _profile_stats.values():
+        stat.__init__()
+    _profile_stepping.update(steps=0,simulated=0.0,wall=0.0,t=0)
+
+def MSXprofilestats():
+    """Returns the statistics collected by MSXprofile as a dict:
+    'functions': {name: {'calls','errors','total','mean','p50','p90','p99','max'}} for every function called
+    (times in seconds; percentiles and max over the latest samples),
+    'stepping': {'steps','simulated','wall','rate'} where rate is simulated seconds per wall second"""
+    functions = {}
+    for name,stat in _profile_stats.items():
+        if stat.calls == 0: continue
+        samples = np.array(stat.samples)
+        p50,p90,p99 = np.percentile(samples,[50,90,99]) if len(samples) else (0.0,0.0,0.0)
+        functions[name] = {'calls':stat.calls,'errors':stat.errors,'total':stat.total,
+                           'mean':stat.total/stat.calls,'p50':float(p50),'p90':float(p90),'p99':float(p99),
+                           'max':float(samples.max()) if len(samples) else 0.0}
+    st = _profile_stepping
+    stepping = {'steps':st['steps'],'simulated':st['simulated'],'wall':st['wall'],
+                'rate':st['simulated']/st['wall'] if st['wall'] > 0 else 0.0}
+    return {'functions':functions,'stepping':stepping}
+
+def MSXprofilejson(fname=None):
+    """Returns the MSXprofilestats dict as a JSON string, also written to the file fname if given"""
+    text = json.dumps(MSXprofilestats(),indent=1,sort_keys=True)
+    if fname is not None:
+        with open(fname,'w') as f:
+            f.write(text)
+    return text
+
 #---------------error messages-------------------------------------------------------------------------
 class MSXtoolkitError(Exception):
-    def __init__(self, ierr):
+    def __init__(self, ierr, message=None):
       self.warning= ierr < 100
       self.args= (ierr,)
-      self.message= MSXgeterror(ierr)
+      self.message= MSXgeterror(ierr) if message is None else message
       if self.message=='' and ierr!=0:
          self.message='MSXtoolkit Undocumented Error '+str(ierr)+': look at text.h in epanet sources'
     def __str__(self):
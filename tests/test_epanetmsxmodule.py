@@ -0,0 +1,288 @@
+"""Behavior tests of epanetmsxmodule against the stub EPANET-MSX library (benchmarks/stub/msxstub.c)
+The stub is built with the local C compiler through benchmarks/stub/build.py; the tests are skipped if that fails.
+Run with: python -m pytest tests"""
+import asyncio
+import gc
+import glob
+import importlib
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+sys.path.insert(0,os.path.join(ROOT,'benchmarks','stub'))
+sys.path.insert(0,ROOT)
+import build
+
+NODES,LINKS,SPECIES = 5,4,2
+DURATION,STEP,RSTEP = 7200,600,1800
+
+@pytest.fixture(scope='module')
+def msx(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('stub')
+    try:
+        library = build.build(os.path.join(str(folder),build.libraryname()))
+    except (OSError,subprocess.CalledProcessError) as e:
+        pytest.skip('cannot build the stub library: %s' % e)
+    # the module loads its library when imported
+    os.environ['EPANETMSX_LIBRARY'] = library
+    module = sys.modules.get('epanetmsxmodule')
+    return importlib.reload(module) if module is not None else importlib.import_module('epanetmsxmodule')
+
+def networkfile(folder,nodes=NODES,links=LINKS,species=SPECIES,constants=1):
+    """Writes the keyword file the stub reads in MSXopen; returns its name"""
+    fname = os.path.join(str(folder),'net%d.msx' % nodes)
+    with open(fname,'w') as f:
+        f.write('NODES %d\nLINKS %d\nSPECIES %d\nPARAMETERS 1\nCONSTANTS %d\nPATTERNS 1\n'
+                'DURATION %d\nSTEP %d\nRSTEP %d\nREPORT %s\n' %
+                (nodes,links,species,constants,DURATION,STEP,RSTEP,os.path.join(str(folder),'net%d.rpt' % nodes)))
+    return fname
+
+@pytest.fixture
+def net(tmp_path):
+    return networkfile(tmp_path)
+
+@pytest.fixture
+def project(msx,net):
+    msx.MSXopen(net)
+    msx.MSXsolveH()
+    yield net
+    msx.MSXclose()
+
+def qualtable(msx,type,ind,species):
+    return np.array([[msx.MSXgetqual(type,i,s) for s in species] for i in ind])
+
+#----------concentrations-----------------------------------------------------
+
+def test_getqualarray_matches_getqual(msx,project):
+    msx.MSXinit(0)
+    msx.MSXstep()
+    np.testing.assert_array_equal(msx.MSXgetqualarray(0),qualtable(msx,0,range(1,NODES+1),(1,2)))
+    np.testing.assert_array_equal(msx.MSXgetqualarray('MSX_LINK',2,[4,1]),qualtable(msx,1,(4,1),(2,))[:,0])
+    # out buffers reuse their pointers; indices changed in place must still be honored
+    ind = np.array([1,3])
+    out = np.empty((2,SPECIES))
+    np.testing.assert_array_equal(msx.MSXgetqualarray(0,None,ind,out),qualtable(msx,0,(1,3),(1,2)))
+    ind[1] = 5
+    np.testing.assert_array_equal(msx.MSXgetqualarray(0,None,ind,out),qualtable(msx,0,(1,5),(1,2)))
+    with pytest.raises(ValueError):
+        msx.MSXgetqualarray(0,None,ind,np.empty((3,SPECIES)))
+
+def test_steps_match_getqual(msx,project):
+    seen = []
+    for t,quals in msx.MSXsteps(0,[2,1],[3,1],size=3):
+        np.testing.assert_array_equal(quals,qualtable(msx,0,(3,1),(2,1)))
+        seen.append((t,quals))
+    assert [t for t,quals in seen] == list(range(STEP,DURATION+1,STEP))
+    # views into the ring stay valid for size-1 more steps
+    np.testing.assert_array_equal(seen[-3][1],seen[-3][1].copy())
+    assert seen[-1][1] is not seen[-2][1]
+    for t,quals in msx.MSXsteps(1,1):
+        np.testing.assert_array_equal(quals,qualtable(msx,1,range(1,LINKS+1),(1,))[:,0])
+    assert t == DURATION
+
+def test_detect_and_profile(msx,project):
+    msx.MSXprofilereset()
+    msx.MSXprofile(True,samples=5)
+    try:
+        level = msx.MSXgetinitqual(0,1,1)
+        found = msx.MSXdetect([(0,1,'<',level*0.999,[1])])
+        assert found.crossings[0][0] == found.t
+        for t,quals in msx.MSXsteps(0,1):
+            pass
+        stats = msx.MSXprofilestats()
+    finally:
+        msx.MSXprofile(False)
+    # steps taken by MSXdetect are accounted along with those of MSXsteps
+    assert stats['stepping']['steps'] == found.t//STEP+DURATION//STEP
+
+def test_getids_is_read_only(msx,project):
+    ids = msx.MSXgetIDs(0)
+    assert isinstance(ids,tuple) and len(ids) == NODES
+    assert msx.MSXgetID(0,2) == ids[1]
+    assert msx.MSXgetindex(0,ids[1].decode()) == 2
+
+#----------results files------------------------------------------------------
+
+def test_outfile_matches_report(msx,project,tmp_path):
+    msx.MSXsolveQ()
+    outfile = str(tmp_path/'out.bin')
+    msx.MSXsaveoutfile(outfile)
+    msx.MSXreport()
+    report = msx.MSXreadreport(os.path.splitext(project)[0]+'.rpt')
+    with msx.MSXoutfile(outfile) as f:
+        assert (f.nodes,f.links,f.species,f.rstep) == (NODES,LINKS,SPECIES,RSTEP)
+        np.testing.assert_array_equal(report['node'].times,f.times())
+        # the report prints %10.4f, the file holds float32
+        np.testing.assert_allclose(report['node'].values,f.nodequal.transpose(1,0,2),atol=1e-4)
+        np.testing.assert_allclose(report['link'].values,f.linkqual.transpose(1,0,2),atol=1e-4)
+    assert report['link'].ids == [id.decode() for id in msx.MSXgetIDs(1)]
+
+def reporttable(kind,id,rows,nspecies):
+    text = '  <<< %s %s >>>\n\n  Time   %s\n  hr:min %s\n  -------%s\n' % (
+        kind,id,''.join('  %10s' % ('S%d' % (j+1)) for j in range(nspecies)),
+        ''.join('  %10s' % 'MG/L' for j in range(nspecies)),'  ----------'*nspecies)
+    for hours,minutes,values in rows:
+        text += '  %4d:%02d' % (hours,minutes)+''.join('  %10.4f' % v for v in values)+'\n'
+    return text+'\n'
+
+def test_readreport_page_breaks_and_wide_hours(msx,tmp_path):
+    fname = str(tmp_path/'hand.rpt')
+    with open(fname,'w') as f:
+        f.write('  Page 1                                    EPANET-MSX\n')
+        f.write(reporttable('Node','N1',[(0,0,[1,2]),(0,30,[3,4])],2))
+        f.write('\f\n  Page 2                                    EPANET-MSX\n')
+        # a node table continued after the page break, and link tables with one more (wall) species
+        f.write(reporttable('Node','N1',[(1,0,[5,6])],2))
+        f.write(reporttable('Link','L1',[(9999,0,[1,2,3]),(10000,30,[4,5,6])],3))
+        f.write(reporttable('Link','L2',[(9999,0,[7,8,9]),(9999,30,[1,1,1])],3))
+    for blocksize in (1<<24,41):
+        report = msx.MSXreadreport(fname,blocksize=blocksize)
+        assert report['node'].ids == ['N1']
+        np.testing.assert_array_equal(report['node'].values[0],[[1,2],[3,4],[5,6]])
+        np.testing.assert_array_equal(report['node'].times,[0,1800,3600])
+        assert report['link'].ids == ['L1','L2'] and report['link'].species == ['S1','S2','S3']
+        np.testing.assert_array_equal(report['link'].values,[[[1,2,3],[4,5,6]],[[7,8,9],[1,1,1]]])
+        np.testing.assert_array_equal(report['link'].times,[9999*3600,10000*3600+1800])
+    with open(fname,'a') as f:
+        f.write(reporttable('Link','L3',[(0,0,[1,2])],2))
+    with pytest.raises(ValueError):
+        msx.MSXreadreport(fname)
+
+def test_recorder_numpy_indices(msx,project,tmp_path):
+    folder = str(tmp_path/'rec')
+    with msx.MSXrecorder(folder,nodes=np.array([2,4]),links=np.array([1]),species=[2],chunksize=4) as rec:
+        rec.run()
+    data = msx.MSXreadrecording(folder)
+    np.testing.assert_array_equal(data['time'],range(0,DURATION+1,STEP))
+    np.testing.assert_allclose(data['node_2'][-1],qualtable(msx,0,(2,4),(2,))[:,0],rtol=1e-6)
+
+#----------scenarios and ensembles-------------------------------------------
+
+def test_scenarios_apply_revert(msx,project):
+    scenarios = msx.MSXscenarios()
+    constant = msx.MSXgetconstant(1)
+    initqual = msx.MSXgetinitqual(0,2,1)
+    scenarios.apply({'constants':{1:2*constant},'initqual':{(0,2,1):initqual+1}})
+    assert msx.MSXgetconstant(1) == 2*constant and msx.MSXgetinitqual(0,2,1) == initqual+1
+    # what the previous scenario set and this one does not is restored
+    scenarios.apply({'constants':{1:3*constant}})
+    assert msx.MSXgetconstant(1) == 3*constant and msx.MSXgetinitqual(0,2,1) == initqual
+    with pytest.raises(msx.MSXtoolkitError):
+        scenarios.apply({'constants':{1:4*constant,99:1.0}})
+    assert msx.MSXgetconstant(1) == constant
+    scenarios.apply({'initqual':{(0,2,1):initqual+1}})
+    scenarios.revert()
+    assert msx.MSXgetinitqual(0,2,1) == initqual and scenarios.applied == {}
+
+def ensemblescenarios(n):
+    return [{'constants':{1:1e-4*(k+1)}} for k in range(n)]
+
+class CrashOn(object):
+    """Ensemble reduce that kills its worker when the scenario's constant is the given one"""
+    def __init__(self,constant):
+        self.constant = constant
+    def __call__(self,times,values):
+        if sys.modules['epanetmsxmodule'].MSXgetconstant(1) == self.constant: os._exit(1)
+        return float(values[-1].sum())
+
+def sharedmemory():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+def test_ensemble_order_and_errors(msx,net):
+    scenarios = ensemblescenarios(5)
+    scenarios[2] = {'constants':{99:1.0}}
+    before = sharedmemory()
+    results = list(msx.MSXensemble(net,scenarios,0,1,[1,3],processes=2,maxinflight=3))
+    assert [r.index for r in results] == list(range(5))
+    assert results[2].error == 516 and results[2].values is None
+    msx.MSXopen(net)
+    try:
+        msx.MSXsolveH()
+        baseline = msx.MSXscenarios()
+        for k in (0,1,3,4):
+            baseline.apply(scenarios[k])
+            expected = np.array([quals.copy() for t,quals in msx.MSXsteps(0,1,[1,3])])
+            assert results[k].error is None
+            np.testing.assert_array_equal(results[k].times,range(STEP,DURATION+1,STEP))
+            np.testing.assert_array_equal(results[k].values,expected)
+    finally:
+        msx.MSXclose()
+    # closing the generator early unlinks the results computed but not yielded
+    gen = msx.MSXensemble(net,ensemblescenarios(6),0,1,processes=2,maxinflight=4)
+    next(gen)
+    gen.close()
+    assert sharedmemory() == before
+
+def test_ensemble_isolates_a_crashing_scenario(msx,net):
+    scenarios = ensemblescenarios(6)
+    results = list(msx.MSXensemble(net,scenarios,0,1,processes=2,maxinflight=4,reduce=CrashOn(4e-4)))
+    assert [r.index for r in results] == list(range(6))
+    assert [r.values is None for r in results] == [False,False,False,True,False,False]
+    assert 'BrokenProcessPool' in results[3].message
+
+def failingsetup():
+    raise RuntimeError('no network')
+
+def test_ensemble_setup_error(msx,net):
+    results = list(msx.MSXensemble(net,ensemblescenarios(2),processes=1,setup=failingsetup))
+    assert [(r.index,r.error) for r in results] == [(0,None),(1,None)]
+    assert all('no network' in r.message for r in results)
+    results = list(msx.MSXensemble(net+'.missing',ensemblescenarios(2),processes=1))
+    assert [r.error for r in results] == [503,503]
+
+#----------projects and the asyncio facade-----------------------------------
+
+def test_project_isolation(msx,net,tmp_path):
+    big = networkfile(tmp_path,nodes=8)
+    msx.MSXopen(net)
+    try:
+        with msx.MSXproject() as p, msx.MSXproject() as q:
+            p.MSXopen(big)
+            q.MSXopen(net)
+            q.MSXsetconstant(1,5e-4)
+            assert (msx.MSXgetcount(0),p.MSXgetcount(0),q.MSXgetcount(0)) == (NODES,8,NODES)
+            assert msx.MSXgetconstant(1) != q.MSXgetconstant(1)
+            with pytest.raises(msx.MSXtoolkitError) as e:
+                p.MSXgetqual(0,99,1)
+            assert e.value.args[0] == 516
+            getqual = p.MSXgetqual
+            folder = p._dir
+            p.close()
+            # functions taken before close raise instead of calling into the unloaded library
+            with pytest.raises(msx.MSXtoolkitError) as e:
+                getqual(0,1,1)
+            assert e.value.args[0] == 519
+            assert not os.path.exists(folder)
+            assert q.MSXgetcount(0) == NODES
+        assert msx.MSXgetcount(0) == NODES
+    finally:
+        msx.MSXclose()
+    # a project that is never closed removes its library copy when collected
+    p = msx.MSXproject()
+    folder = p._dir
+    del p
+    gc.collect()
+    assert not os.path.exists(folder)
+
+def test_async_reads(msx,net):
+    async def main():
+        async with msx.MSXasync() as sim:
+            await sim.call(msx.MSXopen,net)
+            try:
+                await sim.set('MSXsolveH')
+                await sim.set('MSXinit')
+                await sim.step()
+                quals = await asyncio.gather(*[sim.get('MSXgetqual',0,1,1) for k in range(3)])
+                # unhashable arguments are not coalesced, but still read
+                array = await sim.get('MSXgetqualarray',0,1,[1,2])
+                return quals,array,await sim.get('MSXgetqual',0,2,1)
+            finally:
+                await sim.call(msx.MSXclose)
+    quals,array,second = asyncio.run(main())
+    assert quals[0] == quals[1] == quals[2]
+    np.testing.assert_array_equal(array,[quals[0],second])